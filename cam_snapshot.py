@@ -4,17 +4,47 @@
 # Description:
 #    * Takes a set of snapshots from internal camera using pre-determined
 #      settings
-#    * Requires that 'mplayer' player is available
+#    * Requires that 'mplayer' player is available, or, if 'opencv' backend is
+#      selected, that OpenCV Python bindings ('cv2') are installed
+#    * Requires 'proc_exec.py' module in same directory, which executes
+#      'mplayer' without a shell, and times it
+#    * Appends a record of each saved snapshot, with its capture time, contrast,
+#      path, and size, to capture log kept by 'capture_log.py' module in same
+#      directory
 #
 # Arguments:
+#    * --backend (optional)
+#       * mplayer (default): Runs 'mplayer' once per contrast setting, writing
+#         every frame to disk as a JPEG and deleting all but the last
+#       * opencv: Opens video device once for all contrast settings, discards
+#         warm-up frames in memory without decoding or writing them, and
+#         encodes and writes only the kept frame of each setting
+#    * --best-frame (optional)
+#      With 'opencv' backend only; rather than keeping a fixed frame, scores
+#      each frame for focus (variance of Laplacian) and exposure (mean and
+#      spread of brightness histogram), keeps the first frame that passes all
+#      thresholds, or else the best-scoring frame, and stops capturing as soon
+#      as a frame passes
+#    * --timelapse (optional)
+#      With 'opencv' backend only; remains resident, keeping device open and
+#      taking a set of snapshots every given number of seconds (at least 60, as
+#      file names are stamped to the minute); captured frames are held in a
+#      fixed-size ring buffer, from which a pool of threads encodes and writes
+#      them, so that capture timing does not jitter on slow storage; sets that
+#      fall due while a previous set is still being captured are skipped, and
+#      a dry run stops after one set
 #    * --dry (optional)
-#      Dry run; assembles and prints commands without executing them
+#      Dry run; assembles and prints commands without executing them, and
+#      opens no video device and writes no files
 #    * --help (optional)
 #      Displays help message
 #
 # Examples:
 #    * ./cam_snapshot.py
 #    * ./cam_snapshot.py --dry
+#    * ./cam_snapshot.py --backend opencv
+#    * ./cam_snapshot.py --backend opencv --best-frame
+#    * ./cam_snapshot.py --backend opencv --timelapse 300
 #    * ./cam_snapshot.py --help
 #
 # Limitations:
@@ -24,14 +54,45 @@
 
 # Modules
 import argparse
+import collections
+import concurrent.futures
 import os
+import shlex
 import shutil
 import sys
+import threading
 import time
 
+import capture_log
+import proc_exec
+
+# Normalize V4L2 control values to range [0, 1] in OpenCV, so that contrast can
+# be set without knowing device-specific ranges; must be set before device is
+# opened
+os.environ["OPENCV_VIDEOIO_V4L_RANGE_NORMALIZED"] = "1"
+try:
+    import cv2
+except ImportError:  # Only required by 'opencv' backend
+    cv2 = None
+try:
+    import numpy
+except ImportError:  # Only required by best-frame selection
+    numpy = None
+
 # Constants
 BIN_PATHS = {"mplayer": "/usr/bin/mplayer"}
 VIDEO_DEV = "/dev/video0"
+FRAME_INTERVAL_SEC = 1  # Time between frames, during which camera adapts
+SNAPSHOT_SETTINGS = [(0, 10),  # Contrast 0, use 10th frame
+                     (20, 5)]  # Contrast 20, use 5th frame
+SHARPNESS_MIN = 50.0  # Minimum variance of Laplacian of a good frame
+BRIGHTNESS_MIN = 40  # Minimum mean brightness of a good frame
+BRIGHTNESS_MAX = 215  # Maximum mean brightness of a good frame
+SPREAD_MIN = 64  # Minimum spread between 5th and 95th brightness percentiles
+TIMELAPSE_MIN_INTERVAL_SEC = 60  # File names are stamped to the minute
+CONTRAST_SETTLE_SEC = 1  # Time for camera to adapt to a new contrast setting
+RING_BUFFER_FRAMES = 16  # Maximum number of frames awaiting encoding
+WRITER_THREADS = 2
 
 # Main function
 def main(argv):
@@ -39,6 +100,23 @@ def main(argv):
     desc_str = "Takes a set of snapshots from internal camera using "
     desc_str += "pre-determined settings"
     parser = argparse.ArgumentParser(description=desc_str)
+    parser.add_argument(
+        "--backend",
+        choices=["mplayer", "opencv"],
+        default="mplayer",
+        help="Captures by running 'mplayer', or by opening device once in OpenCV"
+    )
+    parser.add_argument(
+        "--best-frame",
+        action="store_true",
+        help="Keeps first frame passing focus and exposure thresholds, or best"
+    )
+    parser.add_argument(
+        "--timelapse",
+        type=float,
+        metavar="SECONDS",
+        help="Remains resident, taking a set of snapshots every given seconds"
+    )
     parser.add_argument(
         "--dry",
         action="store_true",
@@ -55,13 +133,50 @@ def main(argv):
     for (arg, val) in sorted(vars(args).items()):
         print("   * {}: {}".format(arg, val))
     print("")
+    if (args.best_frame) and (args.backend != "opencv"):
+        parser.error("--best-frame requires '--backend opencv'")
+    if (args.timelapse is not None):
+        if (args.backend != "opencv"):
+            parser.error("--timelapse requires '--backend opencv'")
+        if (args.timelapse < TIMELAPSE_MIN_INTERVAL_SEC):
+            parser.error("--timelapse interval must be at least {} seconds".format(
+                TIMELAPSE_MIN_INTERVAL_SEC
+            ))
 
-    # Check that 'mplayer' video player is available
-    check_player_exe()
+    # Execute commands, and operate video device and write files, only if not
+    # dry run
+    proc_exec.configure(args.dry)
 
     # Take snapshots
-    take_snapshot(0, 10, not args.dry)  # Contrast 0, use 10th frame
-    take_snapshot(20, 5, not args.dry)  # Contrast 20, use 5th frame
+    if (args.backend == "mplayer"):
+        # Check that 'mplayer' video player is available
+        check_player_exe()
+
+        for (contrast, frames) in SNAPSHOT_SETTINGS:
+            take_snapshot(contrast, frames)
+    elif (args.backend == "opencv"):
+        # Check that OpenCV, and NumPy if needed, are available
+        check_opencv()
+        if (args.best_frame):
+            check_numpy()
+
+        # Open device once, for all contrast settings
+        video_cap = open_video_dev()
+        try:
+            if (args.timelapse is not None):
+                take_timelapse(video_cap, args.timelapse)
+            else:
+                for (contrast, frames) in SNAPSHOT_SETTINGS:
+                    if (args.best_frame):
+                        take_snapshot_best(video_cap, contrast, frames)
+                    else:
+                        take_snapshot_opencv(video_cap, contrast, frames)
+        finally:
+            if (video_cap):
+                video_cap.release()
+
+    # Summarize time spent running commands
+    proc_exec.print_timings()
 
     # Exit
     print("Done.")
@@ -81,42 +196,314 @@ def check_player_exe():
         msg += "installed."
         raise Exception(msg)
 
+# Checks that OpenCV Python bindings are available
+def check_opencv():
+    print("Checking that OpenCV Python bindings are available...")
+
+    if (cv2):
+        print("OpenCV {} found.".format(cv2.__version__))
+        print("")
+    else:
+        msg = "OpenCV Python bindings not found.  Verify that 'cv2' module "
+        msg += "is installed, e.g. from 'python3-opencv' package."
+        raise Exception(msg)
+
+# Checks that NumPy is available
+def check_numpy():
+    print("Checking that NumPy is available...")
+
+    if (numpy):
+        print("NumPy {} found.".format(numpy.__version__))
+        print("")
+    else:
+        msg = "NumPy not found.  Verify that 'numpy' module is installed, "
+        msg += "e.g. from 'python3-numpy' package."
+        raise Exception(msg)
+
+# Opens video device, and returns it, or None in dry run
+def open_video_dev():
+    print("Opening video device '{}'...".format(VIDEO_DEV))
+    video_cap = proc_exec.call(open_v4l2_dev)
+    print("")
+
+    return video_cap
+
+# Opens video device through V4L2, keeping only its most recent frame, and
+# returns it
+def open_v4l2_dev():
+    video_cap = cv2.VideoCapture(VIDEO_DEV, cv2.CAP_V4L2)
+    if (not video_cap.isOpened()):
+        msg = "Failed to open video device '{}'.".format(VIDEO_DEV)
+        raise Exception(msg)
+    video_cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+
+    return video_cap
+
+# Takes a snapshot with the given contrast and frame number settings on already
+# open video device, discarding earlier frames without decoding them
+def take_snapshot_opencv(video_cap, contrast, frames):
+    print("Setting contrast {}...".format(contrast))
+    proc_exec.call(set_contrast, video_cap, contrast)
+
+    # Discard first frames, which are usually mangled or otherwise unreadable,
+    # grabbing continuously for as long as 'mplayer' would have taken to capture
+    # them, so that camera adapts to scene and contrast setting
+    warm_up_sec = (frames - 1) * FRAME_INTERVAL_SEC
+    msg = "Discarding frames for {} seconds ".format(warm_up_sec)
+    msg += "without decoding them..."
+    print(msg)
+    discarded = proc_exec.call(grab_frames, video_cap, warm_up_sec, default=0)
+    print("Discarded {} frames.".format(discarded))
+
+    # Capture and write frame to file containing date stamp and contrast value
+    name_dst = time.strftime("%Y-%m-%d_%H%M_c{}.jpg".format(str(contrast).zfill(2)))
+    print("Capturing 1 still frame and saving it to file '{}'...".format(name_dst))
+    frame = proc_exec.call(read_frame, video_cap)
+    proc_exec.call(write_frame, name_dst, frame, contrast)
+
+    print("")
+
+# Takes a snapshot with the given contrast on already open video device,
+# capturing up to the given number of frames, 1 interval apart, and keeping the
+# first that passes focus and exposure thresholds, or else the best-scoring one
+def take_snapshot_best(video_cap, contrast, frames):
+    print("Setting contrast {}...".format(contrast))
+    proc_exec.call(set_contrast, video_cap, contrast)
+
+    msg = "Capturing up to {} still frames, ".format(frames)
+    msg += "1 interval apart, until one passes thresholds..."
+    print(msg)
+    name_dst = time.strftime("%Y-%m-%d_%H%M_c{}.jpg".format(str(contrast).zfill(2)))
+    best_frame = proc_exec.call(capture_best_frame, video_cap, frames)
+
+    # Write kept frame to file containing date stamp and contrast value
+    print("Saving best frame to file '{}'...".format(name_dst))
+    proc_exec.call(write_frame, name_dst, best_frame, contrast)
+
+    print("")
+
+# Captures up to the given number of frames, 1 interval apart, on already open
+# video device, and returns the first that passes focus and exposure thresholds,
+# or else the best-scoring one
+def capture_best_frame(video_cap, frames):
+    (best_frame, best_score) = (None, None)
+    for n in range(1, frames + 1):
+        # Grab continuously between frames, so that camera adapts to scene
+        # and most recent frame is retrieved
+        if (n > 1):
+            grab_frames(video_cap, FRAME_INTERVAL_SEC)
+        (success, frame) = video_cap.read()
+        if (not success):
+            continue  # Frame unreadable; try next one
+
+        # Score frame, and keep it if it is best so far
+        (sharpness, brightness, spread) = score_frame(frame)
+        passed = (sharpness >= SHARPNESS_MIN) and \
+                 (BRIGHTNESS_MIN <= brightness <= BRIGHTNESS_MAX) and \
+                 (spread >= SPREAD_MIN)
+        score = sharpness * spread
+        if not (BRIGHTNESS_MIN <= brightness <= BRIGHTNESS_MAX):
+            score /= 4  # Penalize poorly exposed frames
+        msg = "   * Frame {}: sharpness {:.1f}, ".format(n, sharpness)
+        msg += "brightness {:.1f}, spread {:.1f}".format(brightness, spread)
+        if (passed):
+            msg += "; passed"
+        print(msg)
+        if (best_score is None) or (score > best_score) or (passed):
+            (best_frame, best_score) = (frame, score)
+        if (passed):
+            break  # Good enough; stop capturing
+    if (best_frame is None):
+        msg = "Failed to capture any frame from '{}'.".format(VIDEO_DEV)
+        raise Exception(msg)
+
+    return best_frame
+
+# Remains resident, taking a set of snapshots on already open video device every
+# given number of seconds, until interrupted; captured frames are placed in a
+# bounded ring buffer, and encoded and written by a pool of threads
+def take_timelapse(video_cap, interval):
+    ring_buffer = collections.deque(maxlen=RING_BUFFER_FRAMES)
+    ring_lock = threading.Lock()
+    writer_pool = concurrent.futures.ThreadPoolExecutor(max_workers=WRITER_THREADS)
+
+    # Discard warm-up frames once, for as long as first setting would take
+    (_, frames) = SNAPSHOT_SETTINGS[0]
+    warm_up_sec = (frames - 1) * FRAME_INTERVAL_SEC
+    print("Warming up camera for {} seconds...".format(warm_up_sec))
+    proc_exec.call(grab_frames, video_cap, warm_up_sec)
+    print("")
+
+    msg = "Taking a set of snapshots every {} seconds; ".format(interval)
+    msg += "press Ctrl-C to stop..."
+    print(msg)
+    print("")
+    next_time = time.monotonic()
+    try:
+        while True:
+            print(time.strftime("%a %Y-%m-%d %I:%M:%S %p"))
+            for (contrast, _) in SNAPSHOT_SETTINGS:
+                # Capture frame, or, in dry run, queue an empty placeholder,
+                # which is never written
+                print("Capturing 1 still frame, contrast {}...".format(contrast))
+                (success, frame) = proc_exec.call(
+                    capture_settled_frame, video_cap, contrast,
+                    default=(True, None)
+                )
+                if (not success):
+                    print("Failed to capture frame; skipping.")
+                    continue
+
+                # Queue frame for writing, dropping oldest unwritten frame if
+                # writers have fallen too far behind
+                with ring_lock:
+                    if (len(ring_buffer) == ring_buffer.maxlen):
+                        print("Ring buffer full; dropping oldest frame.")
+                    ring_buffer.append((time.time(), contrast, frame))
+                future = writer_pool.submit(
+                    write_oldest_frame, ring_buffer, ring_lock
+                )
+                future.add_done_callback(report_write_error)
+            print("")
+            if (proc_exec.dry_run):
+                print("Dry run; stopping after one set.")
+                print("")
+                break
+
+            # Wait until next set is due, without drifting; if capture fell
+            # behind, skip sets whose time has passed, rather than taking them
+            # in a burst with colliding file names
+            next_time += interval
+            now = time.monotonic()
+            if (next_time < now):
+                missed = int((now - next_time) // interval) + 1
+                print("Fell behind; skipping {} set(s).".format(missed))
+                print("")
+                next_time += missed * interval
+            time.sleep(max(0, next_time - time.monotonic()))
+    except KeyboardInterrupt:  # Stop taking snapshots
+        print("")
+        print("Stopped taking snapshots; writing remaining frames...")
+        print("")
+    finally:
+        writer_pool.shutdown(wait=True)
+
+# Removes oldest frame from ring buffer, if any, and encodes and writes it to
+# file containing its date stamp and contrast value
+def write_oldest_frame(ring_buffer, ring_lock):
+    with ring_lock:
+        if (len(ring_buffer) == 0):
+            return  # Frame was dropped from full buffer
+        (timestamp, contrast, frame) = ring_buffer.popleft()
+
+    name_dst = time.strftime(
+        "%Y-%m-%d_%H%M_c{}.jpg".format(str(contrast).zfill(2)),
+        time.localtime(timestamp),
+    )
+    if (proc_exec.call(write_frame, name_dst, frame, contrast, timestamp,
+                       default=False)):
+        print("Saved '{}'.".format(name_dst))
+
+# Applies given contrast to video device, mapping range of 'mplayer'
+# [-100, 100] to normalized range [0, 1]
+def set_contrast(video_cap, contrast):
+    video_cap.set(cv2.CAP_PROP_CONTRAST, (contrast + 100) / 200)
+
+# Grabs frames continuously for given number of seconds, without decoding them,
+# and returns number grabbed
+def grab_frames(video_cap, seconds):
+    grabbed = 0
+    deadline = time.monotonic() + seconds
+    while (time.monotonic() < deadline):
+        if (video_cap.grab()):
+            grabbed += 1
+
+    return grabbed
+
+# Reads and returns a frame from video device, raising on failure
+def read_frame(video_cap):
+    (success, frame) = video_cap.read()
+    if (not success):
+        msg = "Failed to capture frame from '{}'.".format(VIDEO_DEV)
+        raise Exception(msg)
+
+    return frame
+
+# Applies given contrast, grabs frames while camera adapts to it, and then reads
+# a frame, returning whether it succeeded and frame
+def capture_settled_frame(video_cap, contrast):
+    set_contrast(video_cap, contrast)
+    grab_frames(video_cap, CONTRAST_SETTLE_SEC)
+
+    return video_cap.read()
+
+# Encodes and writes given frame to file, and records it in capture log, with
+# given capture time, or current time if none given; returns True, or raises on
+# failure
+def write_frame(name_dst, frame, contrast, timestamp=None):
+    if (not cv2.imwrite(name_dst, frame)):
+        msg = "Failed to write file '{}'.".format(name_dst)
+        raise Exception(msg)
+    capture_log.append_record(name_dst, contrast, timestamp)
+
+    return True
+
+# Reports error raised by a writer thread, if any, which would otherwise be lost
+# with its future
+def report_write_error(future):
+    error = future.exception()
+    if (error):
+        print("Failed to write frame: {}".format(error))
+
+# Scores focus and exposure of given BGR frame, and returns variance of its
+# Laplacian, its mean brightness, and spread between 5th and 95th percentiles
+# of its brightness
+def score_frame(frame):
+    # Convert to brightness, at half resolution to halve cost
+    gray = frame[::2, ::2].astype(numpy.float32) @ \
+        numpy.array([0.114, 0.587, 0.299], dtype=numpy.float32)  # BGR weights
+
+    # Apply 4-neighbor Laplacian kernel to interior pixels, by summing shifted
+    # views of image
+    laplacian = gray[:-2, 1:-1] + gray[2:, 1:-1] + gray[1:-1, :-2] + \
+        gray[1:-1, 2:] - (4 * gray[1:-1, 1:-1])
+
+    (p5, p95) = numpy.percentile(gray, [5, 95])
+
+    return (float(laplacian.var()), float(gray.mean()), float(p95 - p5))
+
 # Takes a snapshot with the given contrast and frame number settings
-def take_snapshot(contrast, frames, live_run):
+def take_snapshot(contrast, frames):
     # Capture set of still frames, 1 second apart
     msg = "Capturing {} still frames, ".format(frames)
     msg += "contrast {}, 1 second apart...".format(contrast)
     print(msg)
-    cmd = "{} tv:// -tv".format(BIN_PATHS["mplayer"])
-    cmd += " driver=v4l2:device={}".format(VIDEO_DEV)
-    cmd += " -contrast {}".format(contrast)
-    cmd += " -fps 1"
-    cmd += " -frames {}".format(frames)
-    cmd += " -sstep 100"
-    cmd += " -vo jpeg"
-    print(cmd)
-    if (live_run):
-        exit_status = os.system(cmd)
-        if (exit_status != 0):
-            msg = "Command '{}' failed ".format(cmd)
-            msg += "with error code {}.".format(exit_status)
-            raise Exception(msg)
+    cmd = [
+        BIN_PATHS["mplayer"], "tv://",
+        "-tv", "driver=v4l2:device={}".format(VIDEO_DEV),
+        "-contrast", str(contrast),
+        "-fps", "1",
+        "-frames", str(frames),
+        "-sstep", "100",
+        "-vo", "jpeg",
+    ]
+    print(shlex.join(cmd))
+    proc_exec.run_cmd(cmd)
 
     # Discard first frames, which are usually mangled or otherwise unreadable
     print("Discarding first {} frames:".format(frames))
     for n in range(1, frames):
         del_name = "{}.jpg".format(str(n).zfill(8))  # Pad to 8 digits
         print("   * Deleting '{}'...".format(del_name))
-        if (live_run):
-            os.remove(del_name)
+        proc_exec.remove_file(del_name)
 
     # Rename file to contain date stamp and contrast value
     print("Renaming file to contain date stamp and contrast value...")
     name_src = "{}.jpg".format(str(frames).zfill(8))  # Pad to 8 digits
     name_dst = time.strftime("%Y-%m-%d_%H%M_c{}.jpg".format(str(contrast).zfill(2)))
     print("Renaming '{}' to '{}'...".format(name_src, name_dst))
-    if (live_run):
-        os.rename(name_src, name_dst)
+    proc_exec.rename_file(name_src, name_dst)
+    proc_exec.call(capture_log.append_record, name_dst, contrast)
 
     print("")
 
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+
+################################################################################
+# Description:
+#    * Keeps an append-only log of snapshots, on behalf of 'cam_snapshot.py'
+#      and 'rpi_cam_capture.py', which append a record as each snapshot is
+#      saved, and 'solar_snapshot_name_parse.py', which reads records appended
+#      since it last read the log, instead of listing snapshot directory
+#    * Log is a file in home directory named '.capture_log.jsonl', holding one
+#      JSON record per line, in the following format:
+#      {"time":1717430400.123,"contrast":20,"path":"/.../x.jpg","size":245761}
+#      where 'time' is capture time in seconds since epoch, 'contrast' is null
+#      if camera has no contrast setting, and 'path' is absolute
+#    * Each record is appended with a single write to a file opened in append
+#      mode, so that records written by concurrent threads or processes do not
+#      interleave
+#
+# Usage:
+#    * import capture_log
+#    * capture_log.append_record("2024-06-03_1200_c20.jpg", contrast=20)
+#    * (records, offset) = capture_log.read_records(offset)
+#
+# Limitations:
+#    * Tested on only Raspberry Pi 3 Model B and Fedora
+#    * Records are appended atomically only on a local file system
+#    * Log is never rotated; if it is truncated or replaced, readers start
+#      again from its beginning
+################################################################################
+
+
+# Modules
+import json
+import os
+import time
+
+# Constants
+LOG_FILE_PATH = "~/.capture_log.jsonl"
+
+# Returns expanded path of capture log
+def get_log_file_path():
+    log_file_path = os.path.expanduser(LOG_FILE_PATH)
+    log_file_path = os.path.expandvars(log_file_path)
+
+    return log_file_path
+
+# Appends record of a saved snapshot file to capture log, with given capture
+# time, or current time if none given
+def append_record(path, contrast=None, timestamp=None, log_file_path=None):
+    if (timestamp is None):
+        timestamp = time.time()
+    if (log_file_path is None):
+        log_file_path = get_log_file_path()
+
+    record = {
+        "time": round(timestamp, 3),
+        "contrast": contrast,
+        "path": os.path.abspath(path),
+        "size": os.path.getsize(path),
+    }
+    line = json.dumps(record, separators=(",", ":")) + "\n"
+    log_fd = os.open(log_file_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(log_fd, line.encode())
+    finally:
+        os.close(log_fd)
+
+# Reads records appended to capture log since given byte offset, and returns
+# them, along with offset following last complete record; an incomplete last
+# record, still being written, is left to be read next time
+def read_records(offset=0, log_file_path=None):
+    if (log_file_path is None):
+        log_file_path = get_log_file_path()
+
+    records = []
+    with open(log_file_path, "rb") as log_file:
+        if (offset > os.fstat(log_file.fileno()).st_size):
+            offset = 0  # Log was truncated or replaced; start again
+        log_file.seek(offset)
+        for line in log_file:
+            if (not line.endswith(b"\n")):
+                break
+            offset += len(line)
+            try:
+                records.append(json.loads(line))
+            except ValueError:  # Corrupt record; skip it
+                continue
+
+    return (records, offset)
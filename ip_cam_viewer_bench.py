@@ -0,0 +1,372 @@
+#!/usr/bin/env python3
+
+################################################################################
+# Description:
+#    * Benchmarks actions of 'ip_cam_viewer.py' on any Linux machine, without a
+#      Raspberry Pi, by pointing it at fake 'tvservice', 'vcgencmd', 'screen',
+#      'omxplayer', and 'ffmpeg' executables installed in a temporary directory
+#    * Fake executables respond with configurable latency, keep track of screen
+#      sessions and DispmanX layers in files, and log every invocation, so that
+#      subprocess counts can be reported
+#    * Serves each stream from a stand-in RTSP server on localhost, which
+#      answers camera probes, except for a given number of offline cameras,
+#      whose ports refuse connections
+#    * Times each action across given stream counts and failure patterns, and
+#      reports median wall time and number of subprocesses spawned:
+#       * start:   From no streams running
+#       * repair:  From all streams running, with given number of DispmanX
+#                  layers dropped
+#       * restart: From all streams running
+#       * stop:    From all streams running
+#
+# Arguments:
+#    * --streams (optional)
+#      Comma-separated list of stream counts to benchmark
+#    * --dropped (optional)
+#      Comma-separated list of numbers of DispmanX layers to drop before repair
+#    * --latency (optional, repeatable)
+#      Response latency of a fake executable, in seconds, as 'exe=seconds'
+#    * --reps (optional)
+#      Number of repetitions of each measurement, of which median is reported
+#    * --concurrent (optional)
+#      Passes '--concurrent' to 'ip_cam_viewer.py'
+#    * --no-cache (optional)
+#      Passes '--no-cache' to 'ip_cam_viewer.py', so that every action compiles
+#      a new plan rather than reusing the cached one
+#    * --offline (optional)
+#      Number of cameras without a stand-in RTSP server; offline cameras are
+#      included in a stream count only once all online ones are
+#    * --help (optional)
+#      Displays help message
+#
+# Examples:
+#    * ./ip_cam_viewer_bench.py
+#    * ./ip_cam_viewer_bench.py --streams 6,12 --dropped 0,1,6
+#    * ./ip_cam_viewer_bench.py --latency screen=0.05 --concurrent
+#    * ./ip_cam_viewer_bench.py --streams 9 --offline 2
+#
+# Limitations:
+#    * Measures time spent within 'ip_cam_viewer.py', excluding interpreter
+#      startup
+#    * Latencies of fake executables are added to their process startup cost,
+#      which differs from that of the real executables on a Raspberry Pi
+################################################################################
+
+
+# Modules
+import argparse
+import contextlib
+import io
+import json
+import os
+import socket
+import socketserver
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+import ip_cam_viewer
+
+# Constants
+FAKE_EXES = ["tvservice", "vcgencmd", "screen", "omxplayer", "ffmpeg"]
+DISP_RES = (1920, 1080)
+ACTIONS = ["start", "repair", "restart", "stop"]
+
+# Fake executables, as shell scripts; '{state_dir}' and '{latency}' are
+# substituted at installation time
+FAKE_EXE_SCRIPTS = {
+    "tvservice": """#!/bin/sh
+echo "tvservice $*" >> "{state_dir}/calls"
+sleep {latency}
+echo "state 0x12000a [HDMI CEA (16) RGB lim 16:9], {res_x}x{res_y} @ 60.00Hz, progressive"
+""",
+    "vcgencmd": """#!/bin/sh
+echo "vcgencmd $*" >> "{state_dir}/calls"
+sleep {latency}
+case "$1" in
+    dispmanx_list) cat "{state_dir}/dispmanx" 2>/dev/null ;;
+    get_mem)       echo "gpu=128M" ;;
+    measure_temp)  echo "temp=48.3'C" ;;
+esac
+""",
+    "screen": """#!/bin/sh
+echo "screen $*" >> "{state_dir}/calls"
+sleep {latency}
+if [ "$1" = "-list" ]; then
+    echo "There are screens on:"
+    for f in "{state_dir}"/sess_*; do
+        [ -e "$f" ] && echo "	1234.${{f##*/sess_}}	(Detached)"
+    done
+    exit 1
+elif [ "$1" = "-dmS" ]; then
+    touch "{state_dir}/sess_$2"
+    win=$(echo "$*" | sed -n 's/.*--win \\([0-9]*,[0-9]*,[0-9]*,[0-9]*\\).*/\\1/p')
+    if [ -n "$win" ]; then
+        echo "display:2 format:YUV420 transform:0 layer:-127 src:0,0,640,360 dst:$win cost:100 lbm:0 $2" >> "{state_dir}/dispmanx"
+    fi
+elif [ "$1" = "-S" ]; then
+    rm -f "{state_dir}/sess_$2"
+    sed -i "/ $2\\$/d" "{state_dir}/dispmanx" 2>/dev/null
+fi
+exit 0
+""",
+    "omxplayer": """#!/bin/sh
+echo "omxplayer $*" >> "{state_dir}/calls"
+sleep {latency}
+""",
+    "ffmpeg": """#!/bin/sh
+echo "ffmpeg $*" >> "{state_dir}/calls"
+sleep {latency}
+""",
+}
+
+# Stand-in RTSP server, which answers every request with '200 OK'
+class StandInRtspHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        # Read request up to blank line ending its headers
+        for line in self.rfile:
+            if (line.strip() == b""):
+                break
+        self.wfile.write(b"RTSP/1.0 200 OK\r\nCSeq: 1\r\n")
+        self.wfile.write(b"Public: OPTIONS, DESCRIBE\r\n\r\n")
+
+# Main function
+def main(argv):
+    # Configure argument parser
+    desc_str = "Benchmarks actions of 'ip_cam_viewer.py' against fake "
+    desc_str += "Raspberry Pi executables"
+    parser = argparse.ArgumentParser(description=desc_str)
+    parser.add_argument(
+        "--streams",
+        default="1,4,6,9,16",
+        help="Comma-separated list of stream counts to benchmark"
+    )
+    parser.add_argument(
+        "--dropped",
+        default="0,1",
+        help="Comma-separated list of numbers of layers to drop before repair"
+    )
+    parser.add_argument(
+        "--latency",
+        action="append",
+        default=[],
+        metavar="EXE=SECONDS",
+        help="Response latency of a fake executable"
+    )
+    parser.add_argument(
+        "--reps",
+        type=int,
+        default=5,
+        help="Number of repetitions of each measurement"
+    )
+    parser.add_argument(
+        "--concurrent",
+        action="store_true",
+        help="Passes '--concurrent' to 'ip_cam_viewer.py'"
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Passes '--no-cache' to 'ip_cam_viewer.py'"
+    )
+    parser.add_argument(
+        "--offline",
+        type=int,
+        default=0,
+        help="Number of cameras without a stand-in RTSP server"
+    )
+
+    # Print current time
+    print(time.strftime("%a %Y-%m-%d %I:%M:%S %p"))
+    print("")
+
+    # Parse arguments
+    print("Parsing arguments...")
+    args = parser.parse_args()
+    for (arg, val) in sorted(vars(args).items()):
+        print("   * {}: {}".format(arg, val))
+    print("")
+    stream_cnts = [int(n) for n in args.streams.split(",")]
+    dropped_cnts = [int(n) for n in args.dropped.split(",")]
+    latencies = parse_latencies(args.latency)
+
+    # Install fake executables, and point 'ip_cam_viewer.py' at them
+    state_dir = tempfile.mkdtemp(prefix="ip_cam_viewer_bench_")
+    print("Installing fake executables in '{}'...".format(state_dir))
+    install_fake_exes(state_dir, latencies)
+    for exe in FAKE_EXES:
+        ip_cam_viewer.BIN_PATHS[exe] = os.path.join(state_dir, exe)
+    ip_cam_viewer.CFG_FILE_PATH = os.path.join(state_dir, "cfg.json")
+    ip_cam_viewer.PLAN_FILE_PATH = os.path.join(state_dir, "plan.json")
+    ip_cam_viewer.PROBE_STATE_FILE_PATH = os.path.join(state_dir, "probe.json")
+    print("")
+
+    # Serve streams from stand-in RTSP servers, leaving first ones offline, so
+    # that offline cameras appear only in largest stream counts, each of which
+    # uses the last ports
+    max_stream_cnt = max(stream_cnts)
+    print("Starting {} stand-in RTSP servers...".format(
+        max(0, max_stream_cnt - args.offline)
+    ))
+    ports = find_closed_ports(min(args.offline, max_stream_cnt))
+    ports += start_rtsp_servers(max_stream_cnt - args.offline)
+    print("")
+
+    # Benchmark each action across stream counts and failure patterns
+    print("Benchmarking...")
+    print("{:<8} {:>7} {:>7} {:>12} {:>12}".format(
+        "action", "streams", "dropped", "wall_ms", "subprocesses"
+    ))
+    for stream_cnt in stream_cnts:
+        write_cfg(state_dir, ports[-stream_cnt:])
+        for action in ACTIONS:
+            for dropped_cnt in (dropped_cnts if (action == "repair") else [0]):
+                if (dropped_cnt > stream_cnt):
+                    continue  # Cannot drop more layers than there are streams
+                (wall_ms, subproc_cnt) = bench_action(
+                    state_dir, action, stream_cnt, dropped_cnt, args.reps,
+                    args.concurrent, args.no_cache,
+                )
+                print("{:<8} {:>7} {:>7} {:>12.1f} {:>12}".format(
+                    action, stream_cnt, dropped_cnt, wall_ms, subproc_cnt
+                ))
+    print("")
+
+    # Exit
+    print("Done.")
+    print("")
+    sys.exit(0)  # Success
+
+# Parses list of 'exe=seconds' strings into dictionary of latencies by
+# executable, defaulting to no latency
+def parse_latencies(latency_strs):
+    latencies = {exe: 0 for exe in FAKE_EXES}
+
+    for latency_str in latency_strs:
+        (exe, _, seconds) = latency_str.partition("=")
+        if (exe not in latencies):
+            msg = "Unknown executable '{}' specified; ".format(exe)
+            msg += "valid values are {}.".format(", ".join(FAKE_EXES))
+            raise Exception(msg)
+        latencies[exe] = float(seconds)
+
+    return latencies
+
+# Writes fake executables to given directory
+def install_fake_exes(state_dir, latencies):
+    for (exe, script) in FAKE_EXE_SCRIPTS.items():
+        exe_path = os.path.join(state_dir, exe)
+        with open(exe_path, "w") as exe_file:
+            exe_file.write(script.format(
+                state_dir=state_dir,
+                latency=latencies[exe],
+                res_x=DISP_RES[0],
+                res_y=DISP_RES[1],
+            ))
+        os.chmod(exe_path, 0o755)
+        print("   * {} ({} s latency)".format(exe_path, latencies[exe]))
+
+# Starts given number of stand-in RTSP servers on localhost, each in its own
+# thread, and returns their ports
+def start_rtsp_servers(server_cnt):
+    ports = []
+    for _ in range(server_cnt):
+        server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), StandInRtspHandler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        ports.append(server.server_address[1])
+
+    return ports
+
+# Returns given number of localhost ports that refuse connections, by binding
+# and then immediately closing sockets on them
+def find_closed_ports(port_cnt):
+    ports = []
+    for _ in range(port_cnt):
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            ports.append(sock.getsockname()[1])
+
+    return ports
+
+# Writes configuration file with a stream on each of the given ports
+def write_cfg(state_dir, ports):
+    cfg = {"streams": []}
+    for (idx, port) in enumerate(ports):
+        cfg["streams"].append({
+            "name": "bench_{}".format(idx),
+            "uri": "rtsp://127.0.0.1:{}/".format(port),
+        })
+    with open(os.path.join(state_dir, "cfg.json"), "w") as cfg_file:
+        json.dump(cfg, cfg_file)
+
+# Removes all fake screen sessions, DispmanX layers, logged invocations, and
+# back-off state of offline cameras
+def reset_state(state_dir):
+    for name in os.listdir(state_dir):
+        if (name.startswith("sess_")) or \
+           (name in ["dispmanx", "calls", "probe.json"]):
+            os.remove(os.path.join(state_dir, name))
+
+# Runs 'ip_cam_viewer.py' with given arguments in this process, discarding its
+# output
+def run_viewer(args):
+    ip_cam_viewer.launch_times.clear()
+    sys.argv = ["ip_cam_viewer.py"] + args
+    with contextlib.redirect_stdout(io.StringIO()):
+        try:
+            ip_cam_viewer.main(sys.argv)
+        except SystemExit:
+            pass
+
+# Measures given action, preparing state before each repetition, and returns
+# median wall time, in milliseconds, and number of subprocesses spawned
+def bench_action(state_dir, action, stream_cnt, dropped_cnt, reps, concurrent,
+                 no_cache):
+    extra_args = []
+    if (concurrent):
+        extra_args.append("--concurrent")
+    if (no_cache):
+        extra_args.append("--no-cache")
+    calls_path = os.path.join(state_dir, "calls")
+
+    wall_times = []
+    for _ in range(reps):
+        # Prepare state; every action but 'start' begins with all streams up
+        reset_state(state_dir)
+        if (action != "start"):
+            run_viewer(["start"])
+        if (dropped_cnt > 0):
+            drop_layers(state_dir, dropped_cnt)
+        if (os.path.exists(calls_path)):
+            os.remove(calls_path)
+
+        # Time action
+        start_time = time.monotonic()
+        run_viewer([action] + extra_args)
+        wall_times.append(time.monotonic() - start_time)
+
+    # Count subprocesses spawned by last repetition
+    subproc_cnt = 0
+    if (os.path.exists(calls_path)):
+        with open(calls_path) as calls_file:
+            subproc_cnt = len(calls_file.readlines())
+
+    return (statistics.median(wall_times) * 1000, subproc_cnt)
+
+# Removes given number of DispmanX layers, or as many as exist, as though their
+# streams had dropped; no layers exist if all cameras are offline
+def drop_layers(state_dir, dropped_cnt):
+    dispmanx_path = os.path.join(state_dir, "dispmanx")
+    if (not os.path.exists(dispmanx_path)):
+        return
+    with open(dispmanx_path) as dispmanx_file:
+        lines = dispmanx_file.readlines()
+    with open(dispmanx_path, "w") as dispmanx_file:
+        dispmanx_file.writelines(lines[dropped_cnt:])
+
+# Execute 'main()' function
+if (__name__ == "__main__"):
+    main(sys.argv)
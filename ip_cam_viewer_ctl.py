@@ -0,0 +1,449 @@
+#!/usr/bin/env python3
+
+################################################################################
+# Description:
+#    * Distributes RTSP streams from IP cameras across displays of several
+#      Raspberry Pi nodes, each running 'ip_cam_viewer.py'
+#    * Requires 'ip_cam_viewer.py' and 'proc_exec.py' modules in same directory,
+#      and 'ip_cam_viewer.py' on each node
+#    * Expects a configuration file in home directory named
+#      '.ip_cam_viewer_ctl_cfg.json', containing the same top-level keys and
+#      'streams[]' list as that of 'ip_cam_viewer.py', plus a 'nodes[]' list,
+#      in the following format:
+#      {
+#         "nodes": [
+#            {"name": "lobby", "host": "pi@lobby.local", "display_res": [1920, 1080], "capacity": 30},
+#            {"name": "office", "host": "pi@office.local", "display_res": [1280, 720], "capacity": 20,
+#             "viewer_path": "bin/ip_cam_viewer.py"},
+#            {"name": "test", "transport": "local", "display_res": [1280, 720], "capacity": 10,
+#             "env": {"HOME": "/tmp/test_node", "SCREENDIR": "/tmp/test_node/screen"}}
+#         ],
+#         "streams": [...]
+#      }
+#    * Capacity of each node is the total frame rate its decoder can sustain;
+#      streams are assigned, highest priority and frame rate first, each to the
+#      node that would be least loaded relative to its capacity, and each node
+#      then lays out and budgets its own streams as usual
+#    * Transport of each node may be optionally specified:
+#       * ssh (default): Runs 'ip_cam_viewer.py' on 'host' over SSH; path of
+#         'ip_cam_viewer.py' defaults to one in home directory of remote user
+#       * local: Runs 'ip_cam_viewer.py' as a subprocess on this machine, with
+#         given environment variables, e.g. a separate home directory and screen
+#         directory per node, so that several stand-in nodes can be tested on a
+#         single Linux machine; path of 'ip_cam_viewer.py' defaults to one next
+#         to this script
+#    * Before every action, checks that each node is up, by running 'true' on
+#      node, or given 'check_cmd' list of node, if specified, on node over SSH,
+#      or locally with environment variables of node; streams are assigned only
+#      to nodes that are up, so that streams of a node that drops out are
+#      rebalanced across remaining nodes
+#    * Pushes each node its sub-configuration, consisting of its assigned
+#      streams and its display resolution, on standard input of
+#      'ip_cam_viewer.py'
+#    * Keeps sub-configuration last pushed to each node in home directory in a
+#      file named '.ip_cam_viewer_ctl_state.json', so that a node whose
+#      sub-configuration has changed since, e.g. because another node dropped
+#      out or came back, has its previous streams stopped, using previous
+#      sub-configuration, before its new ones are started; a node with no
+#      recorded sub-configuration is stopped using all streams
+#
+# Arguments:
+#    * action (required)
+#       * start:   Assigns streams to nodes that are up, restarting nodes
+#                  whose sub-configuration changed, and starting all others
+#       * repair:  Assigns streams to nodes that are up, restarting nodes
+#                  whose sub-configuration changed, and repairing all others
+#       * restart: Assigns streams to nodes that are up, and restarts all of
+#                  them
+#       * stop:    Stops streams on all nodes that are up
+#    * --cfg (optional)
+#      Path of configuration file to use instead of the one in home directory
+#    * --concurrent (optional)
+#      Runs action on all nodes at once, rather than one at a time
+#    * --dry (optional)
+#      Dry run; checks nodes, and assigns and prints streams and commands,
+#      without executing commands on nodes
+#    * --help (optional)
+#      Displays help message
+#
+# Examples:
+#    * ./ip_cam_viewer_ctl.py start
+#    * ./ip_cam_viewer_ctl.py repair --concurrent
+#    * ./ip_cam_viewer_ctl.py stop
+#
+# Limitations:
+#    * Each stream is displayed on at most one node
+#    * Nodes are checked only when an action is taken; run 'repair'
+#      periodically, e.g. from cron, to rebalance streams of nodes that drop
+#      out
+################################################################################
+
+
+# Modules
+import argparse
+import json
+import os
+import shlex
+import sys
+import time
+
+import ip_cam_viewer
+import proc_exec
+
+# Constants
+BIN_PATHS = {"ssh": "/usr/bin/ssh",
+             "env": "/usr/bin/env"}
+CFG_FILE_PATH = "~/.ip_cam_viewer_ctl_cfg.json"
+STATE_FILE_PATH = "~/.ip_cam_viewer_ctl_state.json"
+TRANSPORTS = ["ssh", "local"]
+DEFAULT_TRANSPORT = "ssh"
+DEFAULT_REMOTE_VIEWER_PATH = "ip_cam_viewer.py"  # Relative to remote home
+SSH_OPTS = ["-o", "BatchMode=yes", "-o", "ConnectTimeout=5"]
+
+# Main function
+def main(argv):
+    # Configure argument parser
+    desc_str = "Distributes RTSP streams from IP cameras across displays of "
+    desc_str += "several Raspberry Pi nodes, each running 'ip_cam_viewer.py'"
+    parser = argparse.ArgumentParser(description=desc_str)
+    parser.add_argument(
+        "action",
+        choices=["start", "repair", "restart", "stop"],
+        help="Action to take"
+    )
+    parser.add_argument(
+        "--cfg",
+        metavar="PATH",
+        default=CFG_FILE_PATH,
+        help="Path of configuration file"
+    )
+    parser.add_argument(
+        "--concurrent",
+        action="store_true",
+        help="Runs action on all nodes at once, rather than one at a time"
+    )
+    parser.add_argument(
+        "--dry",
+        action="store_true",
+        help="Assigns and prints streams and commands without executing them"
+    )
+
+    # Print current time
+    print(time.strftime("%a %Y-%m-%d %I:%M:%S %p"))
+    print("")
+
+    # Parse arguments
+    print("Parsing arguments...")
+    args = parser.parse_args()
+    for (arg, val) in sorted(vars(args).items()):
+        print("   * {}: {}".format(arg, val))
+    print("")
+
+    # Execute commands on nodes only if not dry run
+    proc_exec.configure(args.dry)
+
+    # Parse configuration file
+    cfg_file_path = os.path.expandvars(os.path.expanduser(args.cfg))
+    print("Parsing configuration file '{}'...".format(cfg_file_path))
+    with open(cfg_file_path) as cfg_file:
+        cfg = json.load(cfg_file)
+    check_cfg_file(cfg)  # Check for completeness and validity of file
+    print("")
+
+    # Determine which nodes are up, and which sub-configuration each was last
+    # pushed; for a node with none recorded, e.g. because state file was lost,
+    # assume all streams, so that whatever sessions it runs are stopped
+    up_nodes = check_nodes(cfg["nodes"])
+    prev_sub_cfgs = load_sub_cfgs()
+    all_stream_names = [stream["name"] for stream in cfg["streams"]]
+    for node in up_nodes:
+        if (node["name"] not in prev_sub_cfgs):
+            prev_sub_cfgs[node["name"]] = build_sub_cfg(cfg, node, all_stream_names)
+
+    # Take requested action
+    if (args.action == "stop"):
+        stop_nodes(up_nodes, prev_sub_cfgs, args.concurrent)
+        sub_cfgs = {node["name"]: None for node in up_nodes}
+    else:
+        assignment = assign_streams(cfg, up_nodes)
+        sub_cfgs = {node["name"]: build_sub_cfg(cfg, node, assignment[node["name"]])
+                    for node in up_nodes}
+        if (args.action in ["start", "repair"]):
+            update_nodes(up_nodes, prev_sub_cfgs, sub_cfgs, args.action,
+                         args.concurrent)
+        elif (args.action == "restart"):
+            restart_nodes(up_nodes, prev_sub_cfgs, sub_cfgs, args.concurrent)
+
+    # Record sub-configurations pushed to nodes that are up, keeping those last
+    # pushed to nodes that are down, so that their streams are stopped once
+    # nodes are back
+    prev_sub_cfgs.update(sub_cfgs)
+    proc_exec.call(save_sub_cfgs, prev_sub_cfgs)
+
+    # Summarize time spent running commands
+    proc_exec.print_timings()
+
+    # Exit
+    print("Done.")
+    print("")
+    sys.exit(0)  # Success
+
+# Checks that configuration file contained all required information
+def check_cfg_file(cfg):
+    # Streams and other settings shared with 'ip_cam_viewer.py'
+    ip_cam_viewer.check_cfg_file(cfg)
+    names = [stream["name"] for stream in cfg["streams"]]
+    if (len(set(names)) != len(names)):
+        msg = "Stream names in configuration file are not unique."
+        raise Exception(msg)
+
+    # Nodes
+    if (len(cfg.get("nodes", [])) == 0):
+        msg = "Configuration file does not contain a non-empty 'nodes[]' list."
+        raise Exception(msg)
+    print("Parsed {} nodes from configuration file:".format(len(cfg["nodes"])))
+    node_names = set()
+    for node in cfg["nodes"]:
+        if ("name" not in node):
+            msg = "No 'name' element found for node {}.".format(node)
+            raise Exception(msg)
+        if (node["name"] in node_names):
+            msg = "Node name '{}' is not unique.".format(node["name"])
+            raise Exception(msg)
+        node_names.add(node["name"])
+
+        transport = node.get("transport", DEFAULT_TRANSPORT)
+        if (transport not in TRANSPORTS):
+            msg = "Invalid transport '{}' specified ".format(transport)
+            msg += "for node '{}'; valid values are ".format(node["name"])
+            msg += "{}.".format(", ".join("'{}'".format(t) for t in TRANSPORTS))
+            raise Exception(msg)
+        if (transport == "ssh") and ("host" not in node):
+            msg = "No 'host' element found for node '{}'.".format(node["name"])
+            raise Exception(msg)
+        check_cmd = node.get("check_cmd", ["true"])
+        if (not isinstance(check_cmd, list)) or (len(check_cmd) == 0) or \
+           (not all(isinstance(arg, str) for arg in check_cmd)):
+            msg = "Invalid check command '{}' specified ".format(check_cmd)
+            msg += "for node '{}'; value must be a ".format(node["name"])
+            msg += "non-empty list of strings."
+            raise Exception(msg)
+
+        capacity = node.get("capacity")
+        if (not isinstance(capacity, (int, float))) or (capacity <= 0):
+            msg = "Invalid capacity '{}' specified ".format(capacity)
+            msg += "for node '{}'; value must be a ".format(node["name"])
+            msg += "positive number."
+            raise Exception(msg)
+        if ("display_res" not in node):
+            msg = "No 'display_res' element found for node "
+            msg += "'{}'.".format(node["name"])
+            raise Exception(msg)
+
+        msg = "   * {}: {} ".format(node["name"], transport)
+        if (transport == "ssh"):
+            msg += "to {} ".format(node["host"])
+        msg += "({} x {}, capacity {})".format(
+            node["display_res"][0], node["display_res"][1], capacity
+        )
+        print(msg)
+
+# Checks which nodes are up, and returns list of those
+def check_nodes(nodes):
+    print("Checking nodes...")
+
+    up_nodes = []
+    for node in nodes:
+        check_proc = proc_exec.run_query_cmd(build_check_cmd(node))
+        if (check_proc.returncode == 0):
+            print("   * {}: up".format(node["name"]))
+            up_nodes.append(node)
+        else:
+            msg = "   * {}: down ".format(node["name"])
+            msg += "(check exited with error code {})".format(check_proc.returncode)
+            print(msg)
+    if (len(up_nodes) == 0):
+        msg = "No nodes are up."
+        raise Exception(msg)
+    print("")
+
+    return up_nodes
+
+# Assigns streams to given nodes, highest priority and frame rate first, each to
+# the node whose load relative to its capacity would be lowest, and returns
+# names of streams assigned to each node, in order of configuration file
+def assign_streams(cfg, nodes):
+    print("Assigning streams to nodes...")
+    streams = cfg["streams"]
+    loads = {node["name"]: 0 for node in nodes}
+    assigned_idxs = {node["name"]: [] for node in nodes}
+
+    order = sorted(range(len(streams)), key=lambda idx: (
+        -streams[idx].get("priority", 0),
+        -streams[idx].get("fps", ip_cam_viewer.FPS),
+        idx,
+    ))
+    for idx in order:
+        fps = streams[idx].get("fps", ip_cam_viewer.FPS)
+        node = min(nodes, key=lambda n: (
+            (loads[n["name"]] + fps) / n["capacity"],
+            len(assigned_idxs[n["name"]]),
+        ))
+        loads[node["name"]] += fps
+        assigned_idxs[node["name"]].append(idx)
+
+    # Keep streams of each node in order of configuration file, so that their
+    # cells stay put as other streams come and go
+    assignment = {}
+    for node in nodes:
+        idxs = sorted(assigned_idxs[node["name"]])
+        assignment[node["name"]] = [streams[idx]["name"] for idx in idxs]
+        msg = "   * {}: {} stream(s), ".format(node["name"], len(idxs))
+        msg += "{:.0%} of capacity".format(loads[node["name"]] / node["capacity"])
+        if (loads[node["name"]] > node["capacity"]):
+            msg += "; node will reduce frame rates to fit"
+        print(msg)
+        for name in assignment[node["name"]]:
+            print("      * {}".format(name))
+    print("")
+
+    return assignment
+
+# Runs given action on each given node, pushing it given sub-configuration;
+# skips nodes with no sub-configuration, i.e. no streams assigned
+def run_action_on_nodes(nodes, sub_cfgs, action, concurrent):
+    print("Running '{}' on nodes...".format(action))
+    nodes = [node for node in nodes if (sub_cfgs.get(node["name"]))]
+    if (len(nodes) == 0):
+        print("No streams assigned to nodes; nothing to run.")
+        print("")
+        return
+
+    cmds = []
+    inputs = []
+    for node in nodes:
+        cmd = build_viewer_cmd(node, action)
+        print("{}: {}".format(node["name"], shlex.join(cmd)))
+        cmds.append(cmd)
+        inputs.append(json.dumps(sub_cfgs[node["name"]], sort_keys=True).encode())
+    print("")
+
+    exit_statuses = proc_exec.run_cmds(cmds, concurrent, check=False,
+                                       inputs=inputs)
+    report_node_results(nodes, action, exit_statuses)
+
+# Restarts nodes whose sub-configuration changed since previous action,
+# stopping their previous streams first, and runs given action on all others
+def update_nodes(nodes, prev_sub_cfgs, sub_cfgs, action, concurrent):
+    changed_nodes = [node for node in nodes
+                     if (prev_sub_cfgs.get(node["name"]) != sub_cfgs[node["name"]])]
+    unchanged_nodes = [node for node in nodes if (node not in changed_nodes)]
+
+    if (len(changed_nodes) > 0):
+        msg = "Sub-configuration changed on nodes: "
+        msg += ", ".join(node["name"] for node in changed_nodes)
+        print(msg)
+        print("")
+        restart_nodes(changed_nodes, prev_sub_cfgs, sub_cfgs, concurrent)
+    if (len(unchanged_nodes) > 0):
+        run_action_on_nodes(unchanged_nodes, sub_cfgs, action, concurrent)
+
+# Stops previous streams of given nodes, which waits for them to exit, and then
+# starts new ones
+def restart_nodes(nodes, prev_sub_cfgs, sub_cfgs, concurrent):
+    stop_nodes(nodes, prev_sub_cfgs, concurrent)
+    run_action_on_nodes(nodes, sub_cfgs, "start", concurrent)
+
+# Stops streams of given nodes, using sub-configuration last pushed to each, so
+# that every session it started is stopped even if configuration has changed
+# since
+def stop_nodes(nodes, prev_sub_cfgs, concurrent):
+    run_action_on_nodes(nodes, prev_sub_cfgs, "stop", concurrent)
+
+# Prints result of action on each node
+def report_node_results(nodes, action, exit_statuses):
+    print("Results of '{}':".format(action))
+    for (node, exit_status) in zip(nodes, exit_statuses):
+        if (exit_status is None):  # Dry run
+            result = "not executed"
+        elif (exit_status == 0):  # Success
+            result = "succeeded"
+        else:  # Failure
+            result = "failed with error code {}".format(exit_status)
+        print("   * {}: {}".format(node["name"], result))
+    print("")
+
+# Assembles sub-configuration of given node, containing streams of given names
+# and display resolution of node, or returns None if no streams are given
+def build_sub_cfg(cfg, node, stream_names):
+    if (len(stream_names) == 0):
+        return None
+
+    sub_cfg = {key: val for (key, val) in cfg.items() if (key != "nodes")}
+    sub_cfg["display_res"] = node["display_res"]
+    sub_cfg["streams"] = [stream for stream in cfg["streams"]
+                          if (stream["name"] in stream_names)]
+
+    return sub_cfg
+
+# Assembles command to run 'ip_cam_viewer.py' with given action on given node,
+# reading its configuration from standard input
+def build_viewer_cmd(node, action):
+    viewer_args = [action, "--cfg", "-"]
+    if (node.get("transport", DEFAULT_TRANSPORT) == "ssh"):
+        viewer_path = node.get("viewer_path", DEFAULT_REMOTE_VIEWER_PATH)
+        return build_ssh_cmd(node, ["python3", viewer_path] + viewer_args)
+
+    viewer_path = node.get("viewer_path", os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), "ip_cam_viewer.py"
+    ))
+    return build_local_cmd(node, [sys.executable, viewer_path] + viewer_args)
+
+# Assembles command to check that given node is up, run on node
+def build_check_cmd(node):
+    check_cmd = node.get("check_cmd", ["true"])
+    if (node.get("transport", DEFAULT_TRANSPORT) == "ssh"):
+        return build_ssh_cmd(node, check_cmd)
+
+    return build_local_cmd(node, check_cmd)
+
+# Wraps given command to run on given node over SSH
+def build_ssh_cmd(node, cmd):
+    return [BIN_PATHS["ssh"]] + SSH_OPTS + [node["host"], shlex.join(cmd)]
+
+# Prefixes given command with environment variables of given node, if any
+def build_local_cmd(node, cmd):
+    env_args = ["{}={}".format(key, val)
+                for (key, val) in sorted(node.get("env", {}).items())]
+    if (len(env_args) == 0):
+        return cmd
+
+    return [BIN_PATHS["env"]] + env_args + cmd
+
+# Loads sub-configuration pushed to each node by previous action, if any
+def load_sub_cfgs():
+    state_file_path = os.path.expandvars(os.path.expanduser(STATE_FILE_PATH))
+    try:
+        with open(state_file_path) as state_file:
+            return json.load(state_file)["sub_cfgs"]
+    except (OSError, ValueError, KeyError):  # No previous sub-configurations
+        return {}
+
+# Saves sub-configuration pushed to each node
+def save_sub_cfgs(sub_cfgs):
+    state_file_path = os.path.expandvars(os.path.expanduser(STATE_FILE_PATH))
+    print("Saving sub-configurations to '{}'...".format(state_file_path))
+    print("")
+
+    # Write to temporary file and then rename it, so that a concurrent run never
+    # reads a partially written state; sub-configurations contain URIs with
+    # credentials, so file is readable by owner only
+    tmp_file_path = "{}.{}.tmp".format(state_file_path, os.getpid())
+    tmp_fd = os.open(tmp_file_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with open(tmp_fd, "w") as state_file:
+        json.dump({"time": time.time(), "sub_cfgs": sub_cfgs}, state_file)
+    os.replace(tmp_file_path, state_file_path)
+
+# Execute 'main()' function
+if (__name__ == "__main__"):
+    main(sys.argv)
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+
+################################################################################
+# Description:
+#    * Executes commands on behalf of 'ip_cam_viewer.py' and 'cam_snapshot.py'
+#    * Runs each command directly from its argument list, without a shell, and
+#      times it
+#    * Runs independent commands either one at a time, or concurrently, up to a
+#      limit on number running at once, optionally feeding each given data on
+#      its standard input
+#    * In dry-run mode, commands, file operations, and any other calls made
+#      through module, e.g. to operate a device or write a file, are skipped,
+#      and report None, or a given default, in place of a result; read-only
+#      query commands still run, so that a dry run reflects current state
+#    * Aggregates duration of every command by executable, and optionally
+#      reports duration and exit status of each command to a hook, e.g. for
+#      telemetry
+#
+# Usage:
+#    * import proc_exec
+#    * proc_exec.configure(dry=args.dry, concurrency_limit=4, hook=record_cmd)
+#    * proc_exec.run_cmds([["screen", "-S", "cam0", "-X", "quit"]], True)
+#    * proc_exec.call(save_state, state)
+#    * proc_exec.print_timings()
+#
+# Limitations:
+#    * Tested on only Raspberry Pi 3 Model B and Fedora
+################################################################################
+
+
+# Modules
+import asyncio
+import os
+import shlex
+import subprocess
+import time
+
+# Constants
+DEFAULT_MAX_CONCURRENT = 8  # Maximum number of commands running at once
+
+# Execution mode, limit on concurrent commands, hook called with command,
+# duration, and exit status of each command, and count, total duration, and
+# maximum duration of commands by executable
+dry_run = False
+max_concurrent = DEFAULT_MAX_CONCURRENT
+cmd_hook = None
+timings = {}
+
+# Sets execution mode, limit on concurrent commands, and hook, and clears
+# timings
+def configure(dry=False, concurrency_limit=DEFAULT_MAX_CONCURRENT, hook=None):
+    global dry_run, max_concurrent, cmd_hook
+
+    if (concurrency_limit < 1):
+        msg = "Invalid limit on concurrent commands '{}' ".format(concurrency_limit)
+        msg += "specified; expected a positive integer."
+        raise Exception(msg)
+
+    dry_run = dry
+    max_concurrent = concurrency_limit
+    cmd_hook = hook
+    timings.clear()
+
+# Executes given command, and returns its exit status, or None in dry run; if
+# requested, raises on failure
+def run_cmd(cmd, check=True):
+    return run_cmds([cmd], False, check)[0]
+
+# Executes given commands, either one at a time or concurrently up to limit, and
+# returns their exit statuses, or Nones in dry run; if given, bytes of each of
+# inputs are written to standard input of corresponding command; if requested,
+# raises on failure of any command
+def run_cmds(cmds, concurrent, check=True, inputs=None):
+    if (dry_run):
+        return [None] * len(cmds)
+    if (inputs is None):
+        inputs = [None] * len(cmds)
+
+    if (concurrent) and (len(cmds) > 1):  # Launch up to limit at once
+        exit_statuses = asyncio.run(run_cmds_async(cmds, inputs))
+    else:  # Run each command to completion before launching the next
+        exit_statuses = []
+        for (cmd, input_bytes) in zip(cmds, inputs):
+            start_time = time.monotonic()
+            exit_status = subprocess.run(cmd, input=input_bytes).returncode
+            record_timing(cmd, time.monotonic() - start_time, exit_status)
+            exit_statuses.append(exit_status)
+            if (check) and (exit_status != 0):
+                break  # Do not launch remaining commands
+
+    # Check exit statuses
+    if (check):
+        for (cmd, exit_status) in zip(cmds, exit_statuses):
+            if (exit_status != 0):
+                msg = "Command '{}' failed ".format(shlex.join(cmd))
+                msg += "with error code {}.".format(exit_status)
+                raise Exception(msg)
+
+    return exit_statuses
+
+# Launches given commands as concurrent subprocesses, no more than limit at
+# once, and returns their exit statuses once all of them have exited
+async def run_cmds_async(cmds, inputs):
+    semaphore = asyncio.Semaphore(max_concurrent)
+
+    return await asyncio.gather(*(
+        run_cmd_async(cmd, input_bytes, semaphore)
+        for (cmd, input_bytes) in zip(cmds, inputs)
+    ))
+
+# Launches given command as a subprocess once semaphore allows, writes given
+# bytes, if any, to its standard input, and returns its exit status once it has
+# exited
+async def run_cmd_async(cmd, input_bytes, semaphore):
+    async with semaphore:
+        start_time = time.monotonic()
+        if (input_bytes is None):
+            proc = await asyncio.create_subprocess_exec(*cmd)
+        else:
+            proc = await asyncio.create_subprocess_exec(
+                *cmd, stdin=asyncio.subprocess.PIPE
+            )
+        await proc.communicate(input_bytes)
+        exit_status = proc.returncode
+        record_timing(cmd, time.monotonic() - start_time, exit_status)
+
+    return exit_status
+
+# Runs given read-only query command to completion, even in dry run, and
+# returns its completed process, with its output captured as text
+def run_query_cmd(cmd):
+    start_time = time.monotonic()
+    proc = subprocess.run(cmd, capture_output=True, text=True)
+    record_timing(cmd, time.monotonic() - start_time, proc.returncode)
+
+    return proc
+
+# Removes given file, unless in dry run
+def remove_file(path):
+    if (not dry_run):
+        os.remove(path)
+
+# Renames given file, unless in dry run
+def rename_file(src_path, dst_path):
+    if (not dry_run):
+        os.rename(src_path, dst_path)
+
+# Calls given function with given arguments, and returns its result, unless in
+# dry run, in which case returns given default without calling it
+def call(func, *args, default=None):
+    if (dry_run):
+        return default
+
+    return func(*args)
+
+# Adds duration of given command to timings of its executable, and reports it,
+# along with exit status, to hook, if any
+def record_timing(cmd, duration, exit_status):
+    exe = os.path.basename(cmd[0])
+    (count, total, longest) = timings.get(exe, (0, 0.0, 0.0))
+    timings[exe] = (count + 1, total + duration, max(longest, duration))
+
+    if (cmd_hook):
+        cmd_hook(cmd, duration, exit_status)
+
+# Prints number of commands run, and their total and maximum durations, by
+# executable
+def print_timings():
+    if (len(timings) == 0):
+        return
+
+    print("Command timings:")
+    for (exe, (count, total, longest)) in sorted(timings.items()):
+        msg = "   * {}: {} call(s), {:.3f} s total, ".format(exe, count, total)
+        msg += "{:.3f} s longest".format(longest)
+        print(msg)
+    print("")
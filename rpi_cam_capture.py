@@ -1,57 +1,419 @@
-#!/usr/bin/python
+#!/usr/bin/env python3
 
 ###############################################################################
 # Description:
 #    * Takes a single snapshot from attached camera at full resolution
-#    * Requires attached Raspberry Pi camera module
+#    * Requires attached Raspberry Pi camera module, unless 'fake' backend is
+#      selected
+#    * Appends a record of each saved snapshot, with its capture time, path, and
+#      size, to capture log kept by 'capture_log.py' module in same directory
+#    * Before capturing, polls camera's analog gain, digital gain, and exposure
+#      speed, and captures as soon as all have settled within a tolerance,
+#      rather than waiting a fixed time for brightness adaptation
+#    * Optionally saves a thumbnail alongside full-resolution snapshot; both
+#      come from a single capture, with thumbnail decoded from full-resolution
+#      JPEG at reduced scale, so that sensor is read and JPEG is decoded only
+#      once
+#    * In daemon mode, keeps camera open and adapted to scene, and takes a
+#      snapshot immediately upon each request received over a Unix socket,
+#      replying with either path of saved file, JPEG bytes, thumbnail JPEG
+#      bytes, or pixel array:
+#       * Request 'path\n': replies 'OK <path>\n'
+#       * Request 'jpeg\n': replies 'OK <length>\n', followed by JPEG bytes
+#       * Request 'thumb\n': replies 'OK <length>\n', followed by thumbnail
+#         JPEG bytes
+#       * Request 'pixels\n': replies 'OK <length>\n', followed by pixel
+#         array in '.npy' format, of shape (height, width, 3), decoded at the
+#         reduced scale used for thumbnail rather than at full resolution
+#       * On failure, replies 'ERR <message>\n'
+#    * In motion mode, watches a low-resolution luminance stream from camera,
+#      and takes a full-resolution snapshot only when fraction of pixels that
+#      changed since previous frame crosses a threshold, waiting a cooldown
+#      period between snapshots
+#    * Motion detection can be replayed against a recorded sequence of frames,
+#      without a camera, to tune threshold and cooldown on any machine
 #
 # Arguments:
-#    * None
+#    * --backend (optional)
+#       * picamera (default): Raspberry Pi camera module
+#       * fake: Stand-in camera producing a blank frame, for testing on any
+#         machine
+#    * --daemon (optional)
+#      Keeps camera open, serving capture requests over Unix socket
+#    * --client (optional)
+#      Requests a snapshot from running daemon, and prints path of saved file
+#    * --motion (optional)
+#      Takes a snapshot whenever motion is detected, until interrupted
+#    * --replay (optional)
+#      Runs motion detection against frames recorded in a '.npy' file, of shape
+#      (frames, height, width), and prints frames at which snapshots would be
+#      taken
+#    * --motion-threshold (optional)
+#      Fraction of pixels that must change between frames to detect motion
+#    * --motion-cooldown (optional)
+#      Minimum number of seconds between snapshots triggered by motion
+#    * --socket (optional)
+#      Path of Unix socket of daemon
+#    * --convergence-timeout (optional)
+#      Maximum number of seconds to wait for exposure to settle
+#    * --convergence-tolerance (optional)
+#      Maximum relative change between polls of a settled gain or exposure
+#    * --thumbnail (optional)
+#      Also saves a thumbnail of each snapshot, with '_thumb' appended to its
+#      file name
 #
 # Examples:
 #    * ./rpi_cam_capture.py
+#    * ./rpi_cam_capture.py --daemon
+#    * ./rpi_cam_capture.py --client
+#    * ./rpi_cam_capture.py --daemon --backend fake --socket /tmp/cam.sock
+#    * ./rpi_cam_capture.py --thumbnail
+#    * ./rpi_cam_capture.py --motion --motion-threshold 0.05
+#    * ./rpi_cam_capture.py --replay frames.npy --motion-cooldown 10
 #
 # Limitations:
 #    * Tested on only Raspberry Pi 3 Model B
+#    * Thumbnails require 'PIL' (Pillow) module; pixel arrays additionally
+#      require 'numpy' module
+#    * Motion detection requires 'numpy' module
 ###############################################################################
 
 # Modules
+import argparse
+import io
+import os
+import socket
+import socketserver
 import sys
 import time
-from picamera import PiCamera
+
+import capture_log
+try:
+    from picamera import PiCamera
+except ImportError:  # Only required by 'picamera' backend
+    PiCamera = None
+try:
+    import numpy
+except ImportError:  # Only required for in-memory pixel arrays
+    numpy = None
+try:
+    from PIL import Image
+except ImportError:  # Only required for thumbnails
+    Image = None
 
 # Constants
 RES_X = 2592  # Maximum
 RES_Y = 1944  # Maximum
 ROTATION = 180  # Camera is inverted
 FRAMERATE = 15
-SLEEP_DURATION_SEC = 5  # Allow time for brightness adaptation
+CONVERGENCE_TIMEOUT_SEC = 15  # Maximum time allowed for brightness adaptation
+CONVERGENCE_TOLERANCE = 0.02  # Maximum relative change of settled exposure
+CONVERGENCE_POLL_SEC = 0.1
+CONVERGENCE_STABLE_POLLS = 3  # Consecutive settled polls required
+FAKE_CONVERGENCE_SEC = 1  # Time constant of fake camera's exposure adaptation
+SOCKET_PATH = "/tmp/rpi_cam_capture.sock"
+THUMB_RES_X = 320
+THUMB_RES_Y = 240
+THUMB_QUALITY = 85
+MOTION_RES_X = 128  # Multiple of 32, as required by camera's resizer
+MOTION_RES_Y = 96  # Multiple of 16, as required by camera's resizer
+REPLAY_FPS = FRAMERATE  # Assumed frame rate of recorded frames
+MOTION_PIXEL_DELTA = 25  # Minimum luminance change of a changed pixel
+MOTION_THRESHOLD = 0.02  # Fraction of changed pixels
+MOTION_COOLDOWN_SEC = 30
+
+# Smallest valid JPEG, a single white pixel, produced by fake camera
+FAKE_JPEG = bytes.fromhex(
+    "ffd8ffe000104a46494600010100000100010000ffdb004300080606070605080707070909"
+    "080a0c140d0c0b0b0c1912130f141d1a1f1e1d1a1c1c20242e2720222c231c1c2837292c30"
+    "313434341f27393d38323c2e333432ffc0000b080001000101011100ffc4001f0000010501"
+    "010101010100000000000000000102030405060708090a0bffc400b5100002010303020403"
+    "050504040000017d01020300041105122131410613516107227114328191a1082342b1c115"
+    "52d1f02433627282090a161718191a25262728292a3435363738393a434445464748494a53"
+    "5455565758595a636465666768696a737475767778797a838485868788898a929394959697"
+    "98999aa2a3a4a5a6a7a8a9aab2b3b4b5b6b7b8b9bac2c3c4c5c6c7c8c9cad2d3d4d5d6d7d8"
+    "d9dae1e2e3e4e5e6e7e8e9eaf1f2f3f4f5f6f7f8f9faffda0008010100003f00fbd3ffd9"
+)
+
+class FakeCamera(object):
+    """
+    Stand-in for PiCamera, implementing the subset of its interface used here.
+    """
+
+    def __init__(self):
+        self.resolution = (RES_X, RES_Y)
+        self.rotation = 0
+        self.framerate = FRAMERATE
+        self._preview_start_time = None
+
+    def start_preview(self):
+        self._preview_start_time = time.monotonic()
+
+    def stop_preview(self):
+        self._preview_start_time = None
+
+    def _adapt(self, target):
+        """
+        Return value approaching target exponentially since preview started.
+        """
+
+        if (self._preview_start_time is None):
+            return 0
+        elapsed = time.monotonic() - self._preview_start_time
+        return target * (1 - 0.5 ** (elapsed / FAKE_CONVERGENCE_SEC * 8))
+
+    @property
+    def analog_gain(self):
+        return self._adapt(2.0)
+
+    @property
+    def digital_gain(self):
+        return self._adapt(1.0)
+
+    @property
+    def exposure_speed(self):
+        return int(self._adapt(20000))
+
+    def capture_continuous(self, output, format=None, resize=None,
+                           use_video_port=False):
+        (res_x, res_y) = resize or self.resolution
+        while (True):
+            time.sleep(1 / self.framerate)
+            output.write(bytes(res_x * res_y * 3 // 2))  # Black YUV420 frame
+            yield output
+
+    def capture(self, output, format=None):
+        if (isinstance(output, str)):
+            with open(output, "wb") as output_file:
+                output_file.write(FAKE_JPEG)
+        else:
+            output.write(FAKE_JPEG)
+
+    def close(self):
+        pass
+
+class CaptureRequestHandler(socketserver.StreamRequestHandler):
+    """
+    Handles a single capture request from a client of the daemon.
+    """
+
+    def handle(self):
+        request = self.rfile.readline().decode().strip()
+        try:
+            if (request == "path"):
+                file_name = capture_to_file(
+                    self.server.camera, thumbnail=self.server.thumbnail
+                )
+                reply = "OK {}\n".format(os.path.abspath(file_name))
+                self.wfile.write(reply.encode())
+            elif (request == "jpeg"):
+                jpeg_bytes = capture_to_bytes(self.server.camera)
+                self.wfile.write("OK {}\n".format(len(jpeg_bytes)).encode())
+                self.wfile.write(jpeg_bytes)
+            elif (request == "thumb"):
+                (_, thumb_bytes, _) = capture_outputs(self.server.camera)
+                self.wfile.write("OK {}\n".format(len(thumb_bytes)).encode())
+                self.wfile.write(thumb_bytes)
+            elif (request == "pixels"):
+                (_, _, pixels) = capture_outputs(
+                    self.server.camera, with_pixels=True
+                )
+                npy_stream = io.BytesIO()
+                numpy.save(npy_stream, pixels)
+                npy_bytes = npy_stream.getvalue()
+                self.wfile.write("OK {}\n".format(len(npy_bytes)).encode())
+                self.wfile.write(npy_bytes)
+            else:
+                msg = "ERR Unknown request '{}'\n".format(request)
+                self.wfile.write(msg.encode())
+        except Exception as e:
+            self.wfile.write("ERR {}\n".format(e).encode())
+
+class MotionDetector(object):
+    """
+    Detects motion as fraction of pixels whose luminance changed by at least
+    a given delta since previous frame, reporting at most one detection per
+    cooldown period.
+    """
+
+    def __init__(self, threshold=MOTION_THRESHOLD, cooldown=MOTION_COOLDOWN_SEC,
+                 pixel_delta=MOTION_PIXEL_DELTA):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.pixel_delta = pixel_delta
+        self.prev_frame = None
+        self.last_trigger_time = None
+
+    def update(self, frame, timestamp):
+        """
+        Compare 2D luminance frame taken at given time, in seconds, against
+        previous frame, and return fraction of changed pixels if motion is
+        detected outside cooldown period, or None otherwise.
+        """
+
+        frame = numpy.asarray(frame, dtype=numpy.int16)
+        prev_frame = self.prev_frame
+        self.prev_frame = frame
+        if (prev_frame is None):
+            return None
+
+        changed = numpy.count_nonzero(
+            numpy.abs(frame - prev_frame) >= self.pixel_delta
+        ) / frame.size
+        if (changed < self.threshold):
+            return None
+        if (self.last_trigger_time is not None) and \
+           (timestamp - self.last_trigger_time < self.cooldown):
+            return None
+        self.last_trigger_time = timestamp
+
+        return changed
 
 def main(argv):
     """
     Main function.
     """
 
+    # Configure argument parser
+    desc_str = "Takes a single snapshot from attached camera at full resolution"
+    parser = argparse.ArgumentParser(description=desc_str)
+    parser.add_argument(
+        "--backend",
+        choices=["picamera", "fake"],
+        default="picamera",
+        help="Camera backend"
+    )
+    mode_group = parser.add_mutually_exclusive_group()
+    mode_group.add_argument(
+        "--daemon",
+        action="store_true",
+        help="Keeps camera open, serving capture requests over Unix socket"
+    )
+    mode_group.add_argument(
+        "--client",
+        action="store_true",
+        help="Requests a snapshot from running daemon"
+    )
+    mode_group.add_argument(
+        "--motion",
+        action="store_true",
+        help="Takes a snapshot whenever motion is detected"
+    )
+    mode_group.add_argument(
+        "--replay",
+        metavar="NPY_FILE",
+        help="Runs motion detection against frames recorded in '.npy' file"
+    )
+    parser.add_argument(
+        "--motion-threshold",
+        type=float,
+        default=MOTION_THRESHOLD,
+        help="Fraction of pixels that must change between frames"
+    )
+    parser.add_argument(
+        "--motion-cooldown",
+        type=float,
+        default=MOTION_COOLDOWN_SEC,
+        help="Minimum number of seconds between snapshots triggered by motion"
+    )
+    parser.add_argument(
+        "--socket",
+        default=SOCKET_PATH,
+        help="Path of Unix socket of daemon"
+    )
+    parser.add_argument(
+        "--convergence-timeout",
+        type=float,
+        default=CONVERGENCE_TIMEOUT_SEC,
+        help="Maximum number of seconds to wait for exposure to settle"
+    )
+    parser.add_argument(
+        "--convergence-tolerance",
+        type=float,
+        default=CONVERGENCE_TOLERANCE,
+        help="Maximum relative change between polls of a settled exposure"
+    )
+    parser.add_argument(
+        "--thumbnail",
+        action="store_true",
+        help="Also saves a thumbnail of each snapshot"
+    )
+    args = parser.parse_args()
+    convergence = (args.convergence_timeout, args.convergence_tolerance)
+    if (args.thumbnail) and (not args.client):
+        check_pil()
+    if (args.motion) or (args.replay):
+        check_numpy()
+    detector = MotionDetector(args.motion_threshold, args.motion_cooldown)
+
     # Print current time
     print(time.strftime("%a %Y-%m-%d %I:%M:%S %p"))
     print("")
 
-    # Take single snapshot, and then immediately release resources
-    pi_camera = PiCamera()
-    capture(pi_camera)
-    pi_camera.close()
+    if (args.client):
+        # Request snapshot from daemon
+        print(request_capture(args.socket))
+    elif (args.daemon):
+        # Keep camera open, serving capture requests until interrupted
+        serve(open_camera(args.backend), args.socket, convergence, args.thumbnail)
+    elif (args.motion):
+        # Take snapshots upon motion until interrupted
+        watch_motion(open_camera(args.backend), detector, convergence,
+                     args.thumbnail)
+    elif (args.replay):
+        # Report snapshots that recorded frames would have triggered
+        replay_motion(args.replay, detector)
+    else:
+        # Take single snapshot, and then immediately release resources
+        camera = open_camera(args.backend)
+        configure(camera)
+        capture(camera, convergence, args.thumbnail)
+        camera.close()
 
     # Exit
     print("Done.")
     print("")
     sys.exit(0)  # Success
 
-def capture(pi_camera):
+def open_camera(backend):
     """
-    Take a snapshot and save it to current directory.
+    Open camera of the given backend.
+    """
+
+    if (backend == "fake"):
+        return FakeCamera()
+    if (PiCamera is None):
+        msg = "'picamera' module not found.  Verify that device is a "
+        msg += "Raspberry Pi, and that 'picamera' module is installed."
+        raise Exception(msg)
+    return PiCamera()
+
+def check_pil():
+    """
+    Check that 'PIL' module, required for thumbnails, is installed.
+    """
+
+    if (Image is None):
+        msg = "'PIL' module not found.  Verify that 'Pillow' is installed "
+        msg += "(e.g., 'sudo apt install python3-pil')."
+        raise Exception(msg)
+
+def check_numpy():
+    """
+    Check that 'numpy' module, required for motion detection and pixel arrays,
+    is installed.
+    """
+
+    if (numpy is None):
+        msg = "'numpy' module not found.  Verify that it is installed "
+        msg += "(e.g., 'sudo apt install python3-numpy')."
+        raise Exception(msg)
+
+def configure(pi_camera):
+    """
+    Apply resolution, rotation, and frame rate settings to camera.
     """
 
-    # Configuration
     print("Resolution: {} x {}".format(RES_X, RES_Y))
     print("Rotation: {}".format(ROTATION))
     print("Frame rate: {}".format(FRAMERATE))
@@ -59,15 +421,252 @@ def capture(pi_camera):
     pi_camera.rotation = ROTATION
     pi_camera.framerate = FRAMERATE
 
-    # Capture
-    file_name = time.strftime("%Y-%m-%d_%H%M.jpg")
+def capture(pi_camera, convergence=(CONVERGENCE_TIMEOUT_SEC,
+                                     CONVERGENCE_TOLERANCE), thumbnail=False):
+    """
+    Take a snapshot and save it to current directory, along with a thumbnail
+    if requested.
+    """
+
+    capture_to_file(pi_camera, convergence, thumbnail)
+
+def capture_to_file(pi_camera, convergence=None, thumbnail=False):
+    """
+    Take a snapshot and save it to current directory, returning its file name.
+    If convergence timeout and tolerance are given, start preview and wait for
+    brightness adaptation first; otherwise, camera must already be adapted.
+    If thumbnail is requested, save it too, from the same capture. Record
+    snapshot, but not thumbnail, in capture log.
+    """
+
+    timestamp = time.time()
+    file_name = time.strftime("%Y-%m-%d_%H%M.jpg", time.localtime(timestamp))
+    if (convergence):
+        pi_camera.start_preview()
+        wait_for_convergence(pi_camera, *convergence)
     print("Capturing 1 still frame and saving it to file '{}'...".format(file_name))
+    if (thumbnail):
+        thumb_file_name = file_name.replace(".jpg", "_thumb.jpg")
+        (jpeg_bytes, thumb_bytes, _) = capture_outputs(pi_camera)
+        with open(file_name, "wb") as jpeg_file:
+            jpeg_file.write(jpeg_bytes)
+        print("Saving thumbnail to file '{}'...".format(thumb_file_name))
+        with open(thumb_file_name, "wb") as thumb_file:
+            thumb_file.write(thumb_bytes)
+    else:
+        pi_camera.capture(file_name)
+    capture_log.append_record(file_name, timestamp=timestamp)
+    if (convergence):
+        pi_camera.stop_preview()
+
+    return file_name
+
+def wait_for_convergence(pi_camera, timeout, tolerance):
+    """
+    Poll analog gain, digital gain, and exposure speed of camera whose preview
+    is running, until all change by no more than the given relative tolerance
+    over several consecutive polls, or until timeout; return elapsed time.
+    """
+
+    print("Waiting up to {} seconds for exposure to settle...".format(timeout))
+    start_time = time.monotonic()
+    prev_vals = None
+    stable_polls = 0
+    while (time.monotonic() - start_time < timeout):
+        time.sleep(CONVERGENCE_POLL_SEC)
+        vals = (float(pi_camera.analog_gain),
+                float(pi_camera.digital_gain),
+                float(pi_camera.exposure_speed))
+
+        # Exposure is not yet meaningful until every value is nonzero
+        if (prev_vals) and (all(v > 0 for v in vals)) and \
+           (all(abs(v - p) <= tolerance * p for (v, p) in zip(vals, prev_vals))):
+            stable_polls += 1
+        else:
+            stable_polls = 0
+        prev_vals = vals
+        if (stable_polls >= CONVERGENCE_STABLE_POLLS):
+            elapsed = time.monotonic() - start_time
+            msg = "Exposure settled after {:.2f} seconds ".format(elapsed)
+            msg += "(analog gain {:.2f}, digital gain {:.2f}, ".format(*vals[0:2])
+            msg += "exposure speed {:.0f} us).".format(vals[2])
+            print(msg)
+            return elapsed
+
+    elapsed = time.monotonic() - start_time
+    print("Exposure did not settle within {:.2f} seconds; capturing anyway.".format(elapsed))
+
+    return elapsed
+
+def capture_to_bytes(pi_camera):
+    """
+    Take a snapshot with camera that has already adapted to scene, and return
+    it as JPEG bytes.
+    """
+
+    print("Capturing 1 still frame into memory...")
+    stream = io.BytesIO()
+    pi_camera.capture(stream, format="jpeg")
+
+    return stream.getvalue()
+
+def capture_outputs(pi_camera, thumb_res=(THUMB_RES_X, THUMB_RES_Y),
+                    with_pixels=False):
+    """
+    Take a snapshot with camera that has already adapted to scene, and return
+    full-resolution JPEG bytes, thumbnail JPEG bytes, and, if requested, pixels
+    as NumPy array (otherwise None).  JPEG is encoded by camera once, and
+    decoded once, in draft mode, at the smallest DCT scale (1/1 to 1/8) that
+    still covers thumbnail resolution, rather than at full resolution.  Pixel
+    array is of that reduced-scale decode, not of full-resolution frame, with
+    shape (height, width, 3), e.g. (243, 324, 3) for default resolutions.
+    """
+
+    check_pil()
+    if (with_pixels):
+        check_numpy()
+    jpeg_bytes = capture_to_bytes(pi_camera)
+    image = Image.open(io.BytesIO(jpeg_bytes))
+    image.draft("RGB", thumb_res)
+    image = image.convert("RGB")
+    pixels = None
+    if (with_pixels):
+        pixels = numpy.asarray(image)
+    image.thumbnail(thumb_res)
+    thumb_stream = io.BytesIO()
+    image.save(thumb_stream, format="JPEG", quality=THUMB_QUALITY)
+
+    return (jpeg_bytes, thumb_stream.getvalue(), pixels)
+
+def serve(pi_camera, socket_path, convergence, thumbnail):
+    """
+    Keep camera open and adapted to scene, serving capture requests over Unix
+    socket until interrupted.
+    """
+
+    # Configure camera, and leave preview running so that it stays adapted
+    configure(pi_camera)
     pi_camera.start_preview()
-    time.sleep(SLEEP_DURATION_SEC)
-    pi_camera.capture(file_name)
-    pi_camera.stop_preview()
+    wait_for_convergence(pi_camera, *convergence)
+    print("")
+
+    # Remove stale socket left behind by a previous daemon, if any
+    if (os.path.exists(socket_path)):
+        os.remove(socket_path)
+
+    print("Serving capture requests on '{}'; press Ctrl-C to stop...".format(socket_path))
+    print("")
+    server = socketserver.UnixStreamServer(socket_path, CaptureRequestHandler)
+    server.camera = pi_camera
+    server.thumbnail = thumbnail
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("")
+        print("Stopped serving capture requests.")
+        print("")
+    finally:
+        server.server_close()
+        os.remove(socket_path)
+        pi_camera.stop_preview()
+        pi_camera.close()
+
+def watch_motion(pi_camera, detector, convergence, thumbnail):
+    """
+    Watch low-resolution stream from camera, taking a full-resolution snapshot
+    whenever detector reports motion, until interrupted.
+    """
+
+    # Configure camera, and leave preview running so that it stays adapted
+    configure(pi_camera)
+    pi_camera.start_preview()
+    wait_for_convergence(pi_camera, *convergence)
+    print("")
+
+    msg = "Watching {} x {} stream for motion; ".format(MOTION_RES_X, MOTION_RES_Y)
+    msg += "press Ctrl-C to stop..."
+    print(msg)
+    print("")
+    try:
+        for frame in camera_frames(pi_camera):
+            changed = detector.update(frame, time.monotonic())
+            if (changed is not None):
+                print("Motion detected ({:.1%} of pixels changed).".format(changed))
+                capture_to_file(pi_camera, thumbnail=thumbnail)
+                print("")
+    except KeyboardInterrupt:
+        print("")
+        print("Stopped watching for motion.")
+        print("")
+    finally:
+        pi_camera.stop_preview()
+        pi_camera.close()
+
+def camera_frames(pi_camera):
+    """
+    Yield luminance planes of low-resolution frames from camera's video port,
+    as 2D NumPy arrays, without interrupting full-resolution stills.
+    """
+
+    # Luminance is first plane of YUV420 frame, which is all that is compared
+    stream = io.BytesIO()
+    for _ in pi_camera.capture_continuous(stream, format="yuv",
+                                          resize=(MOTION_RES_X, MOTION_RES_Y),
+                                          use_video_port=True):
+        stream.seek(0)
+        y_plane = stream.read(MOTION_RES_X * MOTION_RES_Y)
+        stream.seek(0)
+        stream.truncate()
+        yield numpy.frombuffer(y_plane, dtype=numpy.uint8).reshape(
+            (MOTION_RES_Y, MOTION_RES_X)
+        )
+
+def replay_motion(npy_path, detector):
+    """
+    Run detector against frames recorded in '.npy' file, assuming they were
+    recorded at camera's frame rate, and print frames at which
+    snapshots would have been taken.
+    """
+
+    frames = numpy.load(npy_path, mmap_mode="r")
+    if (frames.ndim != 3):
+        msg = "Recorded frames in file '{}' have shape {}; ".format(npy_path, frames.shape)
+        msg += "expected (frames, height, width)."
+        raise Exception(msg)
+
+    print("Replaying {} frames from file '{}' at {} fps...".format(len(frames), npy_path, REPLAY_FPS))
+    trigger_cnt = 0
+    for (idx, frame) in enumerate(frames):
+        timestamp = idx / REPLAY_FPS
+        changed = detector.update(frame, timestamp)
+        if (changed is not None):
+            trigger_cnt += 1
+            msg = "   * Frame {} ({:.1f} s): ".format(idx, timestamp)
+            msg += "{:.1%} of pixels changed".format(changed)
+            print(msg)
+    print("{} snapshots would have been taken.".format(trigger_cnt))
+    print("")
+
+def request_capture(socket_path):
+    """
+    Request a snapshot from running daemon, and return path of saved file.
+    """
+
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(socket_path)
+        client.sendall(b"path\n")
+        reply = client.makefile("rb").readline().decode().strip()
+    finally:
+        client.close()
+
+    (status, _, payload) = reply.partition(" ")
+    if (status != "OK"):
+        msg = "Daemon failed to capture snapshot: {}".format(payload)
+        raise Exception(msg)
+
+    return payload
 
 # Execute 'main()' function
 if (__name__ == "__main__"):
    main(sys.argv)
-
@@ -3,39 +3,106 @@
 ################################################################################
 # Description:
 #    * Parses names of files in directory containing snapshots of solar
-#      suitcase displays, and formats them for pasting into timestamp column of
-#      solar energy log spreadsheet
+#      suitcase displays, and in all its subdirectories, and formats them for
+#      pasting into timestamp column of solar energy log spreadsheet
+#    * When only new snapshots are requested, and capture log kept by
+#      'capture_log.py' module in same directory exists, reads capture times of
+#      new snapshots in snapshot directory from it instead, without listing
+#      directory; reads only records appended since previous run, from byte
+#      offset where it stopped
+#    * Otherwise, or if requested, lists directories in parallel, with a pool
+#      of threads, since latency of WebDAV mount dominates
+#    * For a JPEG file whose name does not contain a timestamp, reads EXIF
+#      'DateTimeOriginal' tag from header of file instead, without reading rest
+#      of file
 #    * Requires that Box WebDAV mount is active
 #    * Expects a configuration file in home directory named
 #      '.solar_snapshot_name_parse_cfg.json', in the following format:
 #      {
-#          "snapshot_dir": "/mnt/box_webdav/.../Solar charge logs"
+#          "snapshot_dir": "/mnt/box_webdav/.../Solar charge logs",
+#          "capture_log": "~/.capture_log.jsonl"
 #      }
+#      where 'capture_log' is optional, and defaults to capture log in home
+#      directory
+#    * Keeps an index of files already seen, modification time of each
+#      directory when it was last listed, and offset in capture log where
+#      previous run stopped, in an SQLite database in home directory named
+#      '.solar_snapshot_name_parse_index.sqlite'
 #
 # Arguments:
+#    * --new (optional)
+#      Prints only snapshots added since previous run, reading only new
+#      records of capture log, or else skipping listing of files of any
+#      directory whose modification time is unchanged
+#    * --scan (optional)
+#      With '--new', lists snapshot directory even if capture log exists, e.g.
+#      to find snapshots saved by other means
+#    * --since (optional)
+#      Prints only snapshots taken at or after given date ('YYYY-MM-DD') or
+#      time ('YYYY-MM-DD HH:MM')
+#    * --until (optional)
+#      Prints only snapshots taken at or before given date or time; a date
+#      includes that entire day
+#    * --last (optional)
+#      Prints only given number of most recent snapshots, within any range
+#      given by '--since' and '--until'
+#    * --summary (optional)
+#      Also prints number of snapshots on each day in range, marking days
+#      without any snapshots as gaps
 #    * --help (optional)
 #      Displays help message
 #
 # Examples:
 #    * ./solar_snapshot_name_parse.py
+#    * ./solar_snapshot_name_parse.py --new
+#    * ./solar_snapshot_name_parse.py --new --scan
+#    * ./solar_snapshot_name_parse.py --since 2024-06-03 --until 2024-06-09
+#    * ./solar_snapshot_name_parse.py --last 10 --summary
 #    * ./solar_snapshot_name_parse.py --help
 #
 # Limitations:
 #    * Tested on only Raspbian
 #    * Makes no attempt to verify that Box WebDAV mount is valid
+#    * '--new' relies on WebDAV mount reporting a new directory modification
+#      time when files are added; a run without '--new' always rescans
+#    * Capture log must be on same machine as snapshot directory mount, with
+#      snapshots saved under that mount, or shared with capturing machine;
+#      records of files outside snapshot directory, or neither named by
+#      timestamp nor JPEG files with EXIF timestamp, are ignored, as in
+#      directory listing
+#    * Snapshot times are handled to the minute, as in file names, including
+#      those read from EXIF headers or capture log
+#    * Some WebDAV file systems, e.g. davfs2, download an entire file when it is
+#      opened, even if only its header is read
 ################################################################################
 
 
 # Modules
 import argparse
+import bisect
+import concurrent.futures
+import datetime
+import itertools
 import json
 import os
 import re
+import sqlite3
+import struct
 import sys
 import time
 
+import capture_log
+
 # Constants
 CFG_FILE_PATH = "~/.solar_snapshot_name_parse_cfg.json"
+INDEX_FILE_PATH = "~/.solar_snapshot_name_parse_index.sqlite"
+DATE_FMT = "%Y-%m-%d"
+TIME_FMT = "%Y-%m-%d %H:%M"
+SCAN_THREADS = 8  # Number of directories listed, or files read, at once
+JPEG_EXTS = [".jpg", ".jpeg"]
+EXIF_IFD_TAG = 0x8769  # Offset of EXIF IFD, within IFD0
+DATE_TIME_ORIGINAL_TAG = 0x9003  # Within EXIF IFD
+EXIF_TIME_FMT = "%Y:%m:%d %H:%M:%S"
 
 # Main function
 def main(argv):
@@ -44,6 +111,34 @@ def main(argv):
     desc_str += "solar suitcase displays, and formats them for pasting into "
     desc_str += "timestamp column of solar energy log spreadsheet"
     parser = argparse.ArgumentParser(description=desc_str)
+    parser.add_argument(
+        "--new",
+        action="store_true",
+        help="Prints only snapshots added since previous run"
+    )
+    parser.add_argument(
+        "--scan",
+        action="store_true",
+        help="Lists snapshot directory even if capture log exists"
+    )
+    parser.add_argument(
+        "--since",
+        help="Prints only snapshots taken at or after given date or time"
+    )
+    parser.add_argument(
+        "--until",
+        help="Prints only snapshots taken at or before given date or time"
+    )
+    parser.add_argument(
+        "--last",
+        type=int,
+        help="Prints only given number of most recent snapshots"
+    )
+    parser.add_argument(
+        "--summary",
+        action="store_true",
+        help="Also prints number of snapshots on each day, marking gaps"
+    )
 
     # Print current time
     print(time.strftime("%a %Y-%m-%d %I:%M:%S %p"))
@@ -55,6 +150,8 @@ def main(argv):
     for (arg, val) in sorted(vars(args).items()):
         print("   * {}: {}".format(arg, val))
     print("")
+    since = parse_time_arg(args.since, end_of_day=False)
+    until = parse_time_arg(args.until, end_of_day=True)
 
     # Parse configuration file
     cfg_file_path = os.path.expanduser(CFG_FILE_PATH)
@@ -64,15 +161,68 @@ def main(argv):
     check_cfg_file(cfg)  # Check that file contains all required information
     print("")
 
-    # Retrieve names of files in snapshot directory
-    print("Retrieving names of files in '{}'...".format(cfg["snapshot_dir"]))
-    file_names = os.listdir(cfg["snapshot_dir"])
+    # Open index of file names already seen
+    index_file_path = os.path.expanduser(INDEX_FILE_PATH)
+    index_file_path = os.path.expandvars(index_file_path)
+    print("Opening index '{}'...".format(index_file_path))
+    index = open_index(index_file_path)
+    print("")
+
+    # Read capture times of snapshots not yet indexed from capture log, if only
+    # new snapshots are requested, capture log exists, and directory listing is
+    # not requested; snapshots taken before capture log was started are found
+    # only by directory listing
+    if (cfg["capture_log"]):
+        log_file_path = os.path.expanduser(cfg["capture_log"])
+        log_file_path = os.path.expandvars(log_file_path)
+    else:
+        log_file_path = capture_log.get_log_file_path()
+    if (args.new) and (not args.scan) and (os.path.isfile(log_file_path)):
+        print("Reading new records of capture log '{}'...".format(log_file_path))
+        timestamps = read_capture_log(index, cfg["snapshot_dir"], log_file_path)
+        index.close()
+    else:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=SCAN_THREADS) as pool:
+            # Retrieve paths of files in snapshot directory and its
+            # subdirectories, or only of those not yet indexed
+            if (args.new):
+                print("Retrieving paths of new files in '{}'...".format(cfg["snapshot_dir"]))
+            else:
+                print("Retrieving paths of files in '{}'...".format(cfg["snapshot_dir"]))
+            file_paths = scan_tree(index, cfg["snapshot_dir"], pool, args.new)
+            index.close()
+
+            # Parse timestamps from file names, or else from EXIF headers of
+            # JPEG files
+            print("Parsing timestamps from file names...")
+            (timestamps, unparsed_paths) = parse_file_names(file_paths)
+            if (len(unparsed_paths) > 0):
+                msg = "Reading EXIF timestamps of {} ".format(len(unparsed_paths))
+                msg += "JPEG files not named by timestamp..."
+                print(msg)
+                timestamps += read_exif_timestamps(
+                    cfg["snapshot_dir"], unparsed_paths, pool
+                )
+
+    # Truncate timestamps to the minute, as in file names, and select those in
+    # requested range
+    timestamps = [timestamp.replace(second=0, microsecond=0) for timestamp in
+                  timestamps]
+    timestamps.sort()
+    timestamps = select_timestamps(timestamps, since, until, args.last)
+    print("")
 
-    # Format file names and print results
+    # Format timestamps and print results
     print("Formatting file names and print results...")
-    count = fmt_print_file_names(sorted(file_names))
+    count = fmt_print_timestamps(timestamps)
     print("")
 
+    # Summarize snapshots per day
+    if (args.summary):
+        print("Summarizing snapshots per day...")
+        print_summary(timestamps)
+        print("")
+
     # Exit
     print("Printed {} lines.".format(count))
     print("Done.")
@@ -90,23 +240,340 @@ def check_cfg_file(cfg):
         msg = "Configuration file does not contain 'snapshot_dir' string."
         raise Exception(msg)
 
-# Formats file names and prints results
-def fmt_print_file_names(file_names):
+    # Capture log, which is optional
+    if ("capture_log" in cfg):
+        msg = "Parsed capture log name from configuration file: "
+        msg += "{}".format(cfg["capture_log"])
+        print(msg)
+    else:  # Use default capture log
+        cfg["capture_log"] = None
+
+# Opens index of files and directories, creating it if necessary
+def open_index(index_file_path):
+    index = sqlite3.connect(index_file_path)
+    index.execute("CREATE TABLE IF NOT EXISTS file_names (name TEXT PRIMARY KEY)")
+    index.execute(
+        "CREATE TABLE IF NOT EXISTS dirs "
+        "(path TEXT PRIMARY KEY, parent TEXT, mtime REAL)"
+    )
+    index.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value)")
+
+    return index
+
+# Reads records appended to capture log since previous run, from byte offset
+# where it stopped, and returns capture times of snapshots saved in snapshot
+# directory and not yet indexed; adds files to index, and stores offset where
+# reading stopped
+def read_capture_log(index, snapshot_dir, log_file_path):
+    offset = 0
+    row = index.execute(
+        "SELECT value FROM meta WHERE key = 'capture_log_offset'"
+    ).fetchone()
+    if (row):
+        offset = int(row[0])  # Stored as text in indexes of earlier versions
+    (records, offset) = capture_log.read_records(offset, log_file_path)
+
+    # Keep records of new snapshots in snapshot directory, by path relative to
+    # it, as in directory listing
+    snapshot_dir = os.path.realpath(snapshot_dir)
+    snapshots = {}
+    for record in records:
+        rel_path = os.path.relpath(os.path.realpath(record["path"]), snapshot_dir)
+        if (rel_path.startswith("..")):
+            continue  # Saved elsewhere
+        if (index.execute(
+            "SELECT 1 FROM file_names WHERE name = ?", (rel_path,)
+        ).fetchone() is not None):
+            continue  # Already indexed, e.g. by directory listing
+        snapshots[rel_path] = record["time"]
+
+    with index:  # Commit as a single transaction
+        index.executemany(
+            "INSERT OR IGNORE INTO file_names (name) VALUES (?)",
+            ((path,) for path in snapshots)
+        )
+        index.execute(
+            "INSERT OR REPLACE INTO meta (key, value) "
+            "VALUES ('capture_log_offset', ?)", (offset,)
+        )
+
+    # As in directory listing, count as snapshots only files named by
+    # timestamp, and JPEG files with EXIF timestamp, though all are indexed
+    timestamps = []
+    for (rel_path, snapshot_time) in snapshots.items():
+        (name_timestamps, unparsed_paths) = parse_file_names([rel_path])
+        if (len(unparsed_paths) > 0) and \
+           (read_exif_timestamp(os.path.join(snapshot_dir, rel_path)) is None):
+            continue  # JPEG file without EXIF timestamp
+        if (len(name_timestamps) > 0) or (len(unparsed_paths) > 0):
+            timestamps.append(datetime.datetime.fromtimestamp(snapshot_time))
+
+    msg = "Read {} records, of which {} ".format(len(records), len(timestamps))
+    msg += "are of new snapshots in snapshot directory."
+    print(msg)
+
+    return timestamps
+
+# Lists given directory, relative to snapshot directory, and returns its
+# modification time and relative paths of its subdirectories and files; if its
+# modification time equals given one, skips listing and returns Nones instead
+def list_dir(snapshot_dir, rel_dir, known_mtime):
+    dir_path = os.path.join(snapshot_dir, rel_dir)
+
+    # Directory modification time is read before listing, so that files added
+    # during listing are found again by next scan rather than missed
+    mtime = os.stat(dir_path).st_mtime
+    if (mtime == known_mtime):
+        return (mtime, None, None)
+
+    sub_dirs = []
+    files = []
+    with os.scandir(dir_path) as entries:
+        for entry in entries:
+            rel_path = os.path.join(rel_dir, entry.name)
+            if (entry.is_dir()):
+                sub_dirs.append(rel_path)
+            else:
+                files.append(rel_path)
+
+    return (mtime, sub_dirs, files)
+
+# Lists snapshot directory and all its subdirectories, listing several
+# directories at once, and returns relative paths of all files found, or, if
+# only new ones are requested, of those not yet indexed, without listing files
+# of directories whose modification time is unchanged; adds files and
+# directories found to index
+def scan_tree(index, snapshot_dir, pool, new_only):
+    known_mtimes = dict(index.execute("SELECT path, mtime FROM dirs"))
+
+    def submit(rel_dir):
+        known_mtime = known_mtimes.get(rel_dir) if (new_only) else None
+        return pool.submit(list_dir, snapshot_dir, rel_dir, known_mtime)
+
+    # Start from snapshot directory itself, and submit each subdirectory as soon
+    # as its parent has been listed
+    file_paths = []
+    listed_dirs = []
+    unchanged_cnt = 0
+    pending = {submit(""): ("", None)}
+    while (len(pending) > 0):
+        (done, _) = concurrent.futures.wait(
+            pending, return_when=concurrent.futures.FIRST_COMPLETED
+        )
+        for future in done:
+            (rel_dir, parent) = pending.pop(future)
+            (mtime, sub_dirs, files) = future.result()
+            if (sub_dirs is None):  # Unchanged; descend into known subdirectories
+                unchanged_cnt += 1
+                sub_dirs = [row[0] for row in index.execute(
+                    "SELECT path FROM dirs WHERE parent = ?", (rel_dir,)
+                )]
+            else:
+                listed_dirs.append((rel_dir, parent, mtime, sub_dirs))
+                file_paths += files
+            for sub_dir in sub_dirs:
+                pending[submit(sub_dir)] = (sub_dir, rel_dir)
+
+    # Keep only files not yet indexed, if requested
+    if (new_only):
+        file_paths = [path for path in file_paths if (index.execute(
+            "SELECT 1 FROM file_names WHERE name = ?", (path,)
+        ).fetchone() is None)]
+    update_index(index, file_paths, listed_dirs)
+
+    msg = "Listed {} directories, ".format(len(listed_dirs))
+    msg += "skipped {} unchanged ones, ".format(unchanged_cnt)
+    msg += "and found {} {}files.".format(len(file_paths), "new " if (new_only) else "")
+    print(msg)
+
+    return file_paths
+
+# Adds relative paths of files to index, records modification time of each
+# listed directory, and removes subdirectories no longer found in it; known
+# subdirectories that were skipped as unchanged keep their records
+def update_index(index, file_paths, listed_dirs):
+    with index:  # Commit as a single transaction
+        index.executemany(
+            "INSERT OR IGNORE INTO file_names (name) VALUES (?)",
+            ((path,) for path in file_paths)
+        )
+        for (rel_dir, parent, mtime, sub_dirs) in listed_dirs:
+            known_sub_dirs = [row[0] for row in index.execute(
+                "SELECT path FROM dirs WHERE parent = ?", (rel_dir,)
+            )]
+            index.executemany(
+                "DELETE FROM dirs WHERE path = ?",
+                ((path,) for path in known_sub_dirs if (path not in sub_dirs))
+            )
+            index.execute(
+                "INSERT OR REPLACE INTO dirs (path, parent, mtime) VALUES (?, ?, ?)",
+                (rel_dir, parent, mtime)
+            )
+
+# Parses date or time given as argument, returning None if none was given; a
+# date alone denotes start of that day, or end of that day if requested
+def parse_time_arg(time_str, end_of_day):
+    if (time_str is None):
+        return None
+
+    for fmt in [TIME_FMT, DATE_FMT]:
+        try:
+            parsed = datetime.datetime.strptime(time_str, fmt)
+        except ValueError:
+            continue
+        if (fmt == DATE_FMT) and (end_of_day):
+            parsed += datetime.timedelta(days=1, microseconds=-1)
+        return parsed
+
+    msg = "Invalid date or time '{}' specified; ".format(time_str)
+    msg += "expected 'YYYY-MM-DD' or 'YYYY-MM-DD HH:MM'."
+    raise Exception(msg)
+
+# Parses timestamps from names of snapshot files, and returns them, along with
+# paths of other JPEG files, ignoring all other files
+def parse_file_names(file_paths):
     re_file_name = re.compile(r'^(\d{4}-\d{2}-\d{2})_(\d{2})(\d{2})\.jpg$')
 
-    num_printed = 0
-    for file_name in file_names:
-        m = re_file_name.match(file_name)
+    timestamps = []
+    unparsed_paths = []
+    for file_path in file_paths:
+        m = re_file_name.match(os.path.basename(file_path))
         if m:  # Regular expression match
             m_date = m.group(1)
             m_hour = m.group(2)
             m_minute = m.group(3)
 
-            print("{} {}:{}".format(m_date, m_hour, m_minute))
-            num_printed += 1
+            timestamps.append(datetime.datetime.strptime(
+                "{} {}:{}".format(m_date, m_hour, m_minute), TIME_FMT
+            ))
+        elif (os.path.splitext(file_path)[1].lower() in JPEG_EXTS):
+            unparsed_paths.append(file_path)
+
+    return (timestamps, unparsed_paths)
+
+# Reads EXIF timestamps of given JPEG files, relative to snapshot directory,
+# several at once, and returns those found
+def read_exif_timestamps(snapshot_dir, file_paths, pool):
+    timestamps = pool.map(
+        read_exif_timestamp,
+        (os.path.join(snapshot_dir, path) for path in file_paths)
+    )
+    timestamps = [timestamp for timestamp in timestamps if (timestamp)]
+    if (len(timestamps) < len(file_paths)):
+        msg = "Skipped {} JPEG files ".format(len(file_paths) - len(timestamps))
+        msg += "without EXIF timestamp."
+        print(msg)
+
+    return timestamps
+
+# Reads EXIF 'DateTimeOriginal' tag of JPEG file, reading only its segments up
+# to EXIF segment, and returns it, or None if file is unreadable or has no tag
+def read_exif_timestamp(file_path):
+    try:
+        with open(file_path, "rb") as jpeg_file:
+            if (jpeg_file.read(2) != b"\xff\xd8"):
+                return None  # Not a JPEG file
+
+            # Skip segments until EXIF segment, giving up at start of image data
+            while True:
+                header = jpeg_file.read(4)
+                if (len(header) < 4) or (header[0] != 0xFF) or \
+                   (header[1] in [0xD9, 0xDA]):
+                    return None
+                seg_len = int.from_bytes(header[2:4], "big")
+                if (header[1] != 0xE1):  # Not APP1 segment
+                    jpeg_file.seek(seg_len - 2, os.SEEK_CUR)
+                    continue
+                segment = jpeg_file.read(seg_len - 2)
+                if (segment.startswith(b"Exif\x00\x00")):
+                    return parse_exif_timestamp(segment[6:])
+    except OSError:
+        return None
+
+# Parses 'DateTimeOriginal' tag from TIFF structure of EXIF segment, and
+# returns it, or None if absent or malformed
+def parse_exif_timestamp(tiff):
+    byte_order = {b"II": "<", b"MM": ">"}.get(tiff[0:2])
+    if (byte_order is None):
+        return None
+
+    # Returns entries of image file directory at given offset, by tag
+    def read_ifd(offset):
+        (entry_cnt,) = struct.unpack_from(byte_order + "H", tiff, offset)
+        entries = {}
+        for n in range(entry_cnt):
+            (tag, _, cnt, value) = struct.unpack_from(
+                byte_order + "HHI4s", tiff, offset + 2 + (12 * n)
+            )
+            entries[tag] = (cnt, value)
+        return entries
+
+    try:
+        (ifd0_offset,) = struct.unpack_from(byte_order + "I", tiff, 4)
+        ifd0 = read_ifd(ifd0_offset)
+        if (EXIF_IFD_TAG not in ifd0):
+            return None
+        (exif_ifd_offset,) = struct.unpack(byte_order + "I", ifd0[EXIF_IFD_TAG][1])
+        exif_ifd = read_ifd(exif_ifd_offset)
+        if (DATE_TIME_ORIGINAL_TAG not in exif_ifd):
+            return None
+
+        # Value, 'YYYY:MM:DD HH:MM:SS' and a terminating null, is too long to
+        # be stored in entry, which holds its offset instead
+        (cnt, value) = exif_ifd[DATE_TIME_ORIGINAL_TAG]
+        (value_offset,) = struct.unpack(byte_order + "I", value)
+        time_str = tiff[value_offset:value_offset + cnt].rstrip(b"\x00").decode()
+        return datetime.datetime.strptime(time_str, EXIF_TIME_FMT)
+    except (struct.error, UnicodeDecodeError, ValueError):
+        return None
+
+# Selects timestamps within given range, by binary search of sorted list, and
+# then only given number of most recent ones
+def select_timestamps(timestamps, since, until, last):
+    start = 0
+    end = len(timestamps)
+    if (since is not None):
+        start = bisect.bisect_left(timestamps, since)
+    if (until is not None):
+        end = bisect.bisect_right(timestamps, until)
+    if (last is not None):
+        start = max(start, end - last)
+
+    return timestamps[start:end]
+
+# Formats timestamps and prints results
+def fmt_print_timestamps(timestamps):
+    num_printed = 0
+    for timestamp in timestamps:
+        print(timestamp.strftime(TIME_FMT))
+        num_printed += 1
 
     return num_printed
 
+# Prints number of snapshots on each day from first to last timestamp, marking
+# days without any snapshots as gaps
+def print_summary(timestamps):
+    day_counts = {
+        day: len(list(group))
+        for (day, group) in itertools.groupby(timestamps, key=lambda t: t.date())
+    }
+    if (not day_counts):
+        print("No snapshots in range.")
+        return
+
+    day = min(day_counts)
+    gap_cnt = 0
+    while (day <= max(day_counts)):
+        if (day in day_counts):
+            print("   * {}: {}".format(day.strftime(DATE_FMT), day_counts[day]))
+        else:
+            print("   * {}: 0 (gap)".format(day.strftime(DATE_FMT)))
+            gap_cnt += 1
+        day += datetime.timedelta(days=1)
+    print("{} days, of which {} without snapshots.".format(
+        (max(day_counts) - min(day_counts)).days + 1, gap_cnt
+    ))
+
 # Execute 'main()' function
 if (__name__ == "__main__"):
     main(sys.argv)